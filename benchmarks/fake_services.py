@@ -0,0 +1,488 @@
+"""
+Local stand-ins for the services the actions talk to: Azure OpenAI, Bedrock, the OpsGenie Alert API
+and the Kubernetes API server. Every server runs on an ephemeral port in a background thread and
+can inject latency and errors.
+"""
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs, unquote, urlsplit
+
+
+class FaultInjection(object):
+    """
+    :param latency: Mean response time in seconds
+    :param jitter: Response times vary uniformly by this fraction of the latency
+    :param error_rate: Fraction of requests answered with error_status
+    :param error_status: HTTP status of injected errors, 429 responses carry a Retry-After header
+    """
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.2, error_rate: float = 0.0, error_status: int = 500):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+
+    def delay(self) -> float:
+        return max(0.0, self.latency * (1 + random.uniform(-self.jitter, self.jitter)))
+
+    def should_fail(self) -> bool:
+        return random.random() < self.error_rate
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # HTTP/1.0: every response closes its connection, so streamed bodies need no content length
+    protocol_version = "HTTP/1.0"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.server.fake.dispatch(self, "GET")
+
+    def do_POST(self):
+        self.server.fake.dispatch(self, "POST")
+
+    def do_PATCH(self):
+        self.server.fake.dispatch(self, "PATCH")
+
+    def do_DELETE(self):
+        self.server.fake.dispatch(self, "DELETE")
+
+    def body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b""
+        try:
+            return json.loads(raw) if raw else None
+        except ValueError:
+            return raw.decode(errors="replace")
+
+    def send_json(self, status: int, payload, headers: Dict[str, str] = None):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_text(self, status: int, text: str):
+        data = text.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "text/plain")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class FakeServer(object):
+    """
+    Base of the fake services, subclasses implement handle().
+    """
+
+    def __init__(self, faults: Optional[FaultInjection] = None):
+        self.faults = faults or FaultInjection()
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.injected_errors = 0
+        self.stopped = threading.Event()
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.fake = self
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name=type(self).__name__, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.httpd.server_address[1]}"
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            return {"requests": self.requests, "injected_errors": self.injected_errors}
+
+    def dispatch(self, request: _Handler, method: str):
+        with self.lock:
+            self.requests += 1
+        time.sleep(self.faults.delay())
+        if self.faults.should_fail():
+            with self.lock:
+                self.injected_errors += 1
+            status = self.faults.error_status
+            request.send_json(status, {"message": "injected error"}, {"Retry-After": "1"} if status == 429 else None)
+            return
+        url = urlsplit(request.path)
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        try:
+            self.handle(request, method, unquote(url.path), query, request.body() if method in ("POST", "PATCH") else None)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def handle(self, request: _Handler, method: str, path: str, query: Dict[str, str], body):
+        raise NotImplementedError()
+
+
+def suggest_command(prompt: str) -> str:
+    """
+    The answer of the fake LLM: a kubectl command for the namespace and workload named in the prompt.
+    """
+    namespace = re.search(r"\bnamespace: ([\w.-]+)", prompt)
+    deployment = re.search(r"\bdeployment: ([\w.-]+)", prompt)
+    pod = re.search(r"\bpod: ([\w.-]+)", prompt)
+    ns = namespace.group(1) if namespace else "default"
+    if deployment:
+        return f"kubectl rollout restart deployment {deployment.group(1)} -n {ns}"
+    if pod:
+        return f"kubectl delete pod {pod.group(1)} -n {ns}"
+    return f"kubectl get pods -n {ns}"
+
+
+class FakeLLMServer(FakeServer):
+    """
+    Answers Azure OpenAI chat completions (including server-sent event streams) under
+    /openai/deployments/, and Bedrock style {'request': ...} prompts on every other path.
+    """
+
+    def handle(self, request, method, path, query, body):
+        if method != "POST" or not isinstance(body, dict):
+            request.send_json(404, {"message": f"{method} {path} not found"})
+            return
+
+        if path.startswith("/openai/deployments/"):
+            prompt = "\n".join(m.get("content", "") for m in body.get("messages", []))
+            answer = suggest_command(prompt)
+            if body.get("stream"):
+                self.__stream(request, answer)
+                return
+            request.send_json(200, {
+                "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+                "object": "chat.completion",
+                "model": body.get("model", ""),
+                "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": answer}}],
+                "usage": {"prompt_tokens": len(prompt) // 4, "completion_tokens": len(answer) // 4,
+                          "total_tokens": (len(prompt) + len(answer)) // 4},
+            })
+            return
+
+        request.send_json(200, {"completion": suggest_command(str(body.get("request", "")))})
+
+    def __stream(self, request, answer: str):
+        request.send_response(200)
+        request.send_header("Content-Type", "text/event-stream")
+        request.end_headers()
+        for word in re.split(r"(?<= )", answer):
+            chunk = {"choices": [{"index": 0, "delta": {"content": word}}]}
+            request.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            request.wfile.flush()
+            time.sleep(0.005)
+        request.wfile.write(b"data: [DONE]\n\n")
+
+
+class FakeOpsGenieServer(FakeServer):
+    """
+    The parts of the OpsGenie Alert API v2 used by the actions. An open alert is created for every
+    tag and message searched for, as if Alertmanager had sent it to OpsGenie as well. Write requests
+    are processed asynchronously after processing_delay seconds, their status can be polled.
+    """
+
+    def __init__(self, faults: Optional[FaultInjection] = None, processing_delay: float = 0.2):
+        super().__init__(faults)
+        self.processing_delay = processing_delay
+        self.alerts: Dict[str, dict] = {}
+        self.notes: Dict[str, List[str]] = {}
+        self.write_requests: Dict[str, tuple] = {}
+
+    def handle(self, request, method, path, query, body):
+        if method == "GET" and path == "/v2/alerts":
+            self.__list(request, query)
+            return
+        match = re.fullmatch(r"/v2/alerts/requests/([\w-]+)", path)
+        if method == "GET" and match:
+            self.__request_status(request, match.group(1))
+            return
+        match = re.fullmatch(r"/v2/alerts/([\w-]+)/(notes|tags|close|acknowledge|priority|details|assign)", path)
+        if method == "POST" and match:
+            alert_id, action = match.groups()
+            if action == "notes" and isinstance(body, dict):
+                with self.lock:
+                    self.notes.setdefault(alert_id, []).append(body.get("note", ""))
+            request_id = str(uuid.uuid4())
+            with self.lock:
+                self.write_requests[request_id] = (time.monotonic() + self.processing_delay, action, alert_id)
+            request.send_json(202, {"result": "Request will be processed", "took": 0.001, "requestId": request_id})
+            return
+        request.send_json(404, {"message": f"{method} {path} not found", "took": 0.0, "requestId": str(uuid.uuid4())})
+
+    def __list(self, request, query):
+        search = query.get("query", "")
+        tags = re.findall(r"tag: '([^']*)'", search)
+        message = re.search(r"message: '([^']*)'", search)
+        key = f"{','.join(tags)}|{message.group(1) if message else ''}"
+        now = time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime())
+        with self.lock:
+            if key not in self.alerts:
+                self.alerts[key] = {
+                    "id": str(uuid.uuid4()), "tinyId": str(len(self.alerts) + 1), "alias": key,
+                    "message": message.group(1) if message else "benchmark alert", "status": "open",
+                    "acknowledged": False, "isSeen": False, "tags": tags, "snoozed": False, "count": 1,
+                    "lastOccurredAt": now, "createdAt": now, "updatedAt": now, "source": "benchmark",
+                    "owner": "", "priority": "P3", "responders": [], "integration": {"id": "benchmark", "name": "benchmark", "type": "API"},
+                }
+            alerts = [self.alerts[key]]
+        offset, limit = int(query.get("offset", 0)), int(query.get("limit", 20))
+        request.send_json(200, {"data": alerts[offset:offset + limit], "took": 0.001, "requestId": str(uuid.uuid4())})
+
+    def __request_status(self, request, request_id: str):
+        with self.lock:
+            write = self.write_requests.get(request_id)
+        if write is None:
+            request.send_json(404, {"message": "Request not found", "took": 0.0, "requestId": request_id})
+            return
+        ready_at, action, alert_id = write
+        processed = time.monotonic() >= ready_at
+        request.send_json(200, {"data": {
+            "success": processed, "isSuccess": processed, "action": action, "processedAt": "2023-01-01T00:00:00.000Z",
+            "integrationId": "benchmark", "status": "processed" if processed else "processing",
+            "alertId": alert_id, "alias": ""}, "took": 0.001, "requestId": request_id})
+
+
+class FakeKubernetesServer(FakeServer):
+    """
+    A Kubernetes API server with namespaces*deployments*replicas pods, a share of them crash looping.
+    Supports the calls of the cluster context, the change journal and the kubectl executor: pod,
+    deployment and event lists and watches, pod logs and deletion, deployment reads, restarts and
+    scaling, and node reads and cordoning. Deleted pods are recreated, like their ReplicaSet would,
+    and all changes are sent to watchers along with the events Kubernetes would record.
+    """
+
+    def __init__(self, faults: Optional[FaultInjection] = None, namespaces: int = 10, deployments: int = 5,
+                 replicas: int = 3, nodes: int = 5, unhealthy_share: float = 0.1):
+        super().__init__(faults)
+        self.resource_version = 1
+        self.nodes = [f"node-{i}" for i in range(nodes)]
+        self.pods: Dict[str, dict] = {}
+        self.deployments: Dict[str, dict] = {}
+        self.events: List[dict] = []
+        self.watchers: Dict[str, List[list]] = {"pods": [], "deployments": [], "events": []}
+        self.watch_condition = threading.Condition(self.lock)
+        for n in range(namespaces):
+            for d in range(deployments):
+                namespace, name = f"ns-{n}", f"app-{d}"
+                self.deployments[f"{namespace}/{name}"] = self.__deployment(namespace, name, replicas)
+                for r in range(replicas):
+                    pod = self.__add_pod(namespace, name, random.random() < unhealthy_share)
+                    if not pod["status"]["containerStatuses"][0]["ready"]:
+                        self.__add_event(pod, "Warning", "BackOff", "Back-off restarting failed container app")
+
+    def kubeconfig(self) -> dict:
+        return {
+            "apiVersion": "v1", "kind": "Config", "current-context": "benchmark",
+            "clusters": [{"name": "benchmark", "cluster": {"server": self.url}}],
+            "users": [{"name": "benchmark", "user": {"token": "benchmark"}}],
+            "contexts": [{"name": "benchmark", "context": {"cluster": "benchmark", "user": "benchmark"}}],
+        }
+
+    def stop(self):
+        with self.watch_condition:
+            self.stopped.set()
+            self.watch_condition.notify_all()
+        super().stop()
+
+    def __next_version(self) -> str:
+        self.resource_version += 1
+        return str(self.resource_version)
+
+    def __add_pod(self, namespace: str, deployment: str, unhealthy: bool = False) -> dict:
+        name = f"{deployment}-{uuid.uuid4().hex[:5]}"
+        state = {"waiting": {"reason": "CrashLoopBackOff"}} if unhealthy else {"running": {"startedAt": "2023-01-01T00:00:00Z"}}
+        pod = {
+            "apiVersion": "v1", "kind": "Pod",
+            "metadata": {"name": name, "namespace": namespace, "uid": str(uuid.uuid4()),
+                         "labels": {"app": deployment}, "resourceVersion": self.__next_version(),
+                         "ownerReferences": [{"apiVersion": "apps/v1", "kind": "ReplicaSet", "name": f"{deployment}-5d8f",
+                                              "uid": "benchmark", "controller": True}]},
+            "spec": {"nodeName": random.choice(self.nodes), "containers": [{"name": "app", "image": "app:1.0"}]},
+            "status": {"phase": "Running", "containerStatuses": [{
+                "name": "app", "image": "app:1.0", "imageID": "", "ready": not unhealthy,
+                "restartCount": random.randint(3, 40) if unhealthy else 0, "state": state}]},
+        }
+        self.pods[f"{namespace}/{name}"] = pod
+        return pod
+
+    def __deployment(self, namespace: str, name: str, replicas: int) -> dict:
+        return {
+            "apiVersion": "apps/v1", "kind": "Deployment",
+            "metadata": {"name": name, "namespace": namespace, "uid": str(uuid.uuid4()), "annotations": {}},
+            "spec": {"replicas": replicas, "selector": {"matchLabels": {"app": name}},
+                     "template": {"metadata": {"labels": {"app": name}},
+                                  "spec": {"containers": [{"name": "app", "image": "app:1.0"}]}}},
+            "status": {"replicas": replicas, "readyReplicas": replicas, "updatedReplicas": replicas,
+                       "availableReplicas": replicas},
+        }
+
+    def __node(self, name: str, unschedulable: bool = False) -> dict:
+        return {"apiVersion": "v1", "kind": "Node", "metadata": {"name": name},
+                "spec": {"unschedulable": unschedulable},
+                "status": {"conditions": [{"type": "Ready", "status": "True"}]}}
+
+    def __add_event(self, obj: dict, event_type: str, reason: str, message: str) -> dict:
+        now = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+        event = {
+            "apiVersion": "v1", "kind": "Event", "type": event_type, "reason": reason, "message": message,
+            "metadata": {"name": f"{obj['metadata']['name']}.{uuid.uuid4().hex[:8]}", "namespace": obj["metadata"]["namespace"],
+                         "resourceVersion": self.__next_version()},
+            "involvedObject": {"kind": obj["kind"], "name": obj["metadata"]["name"], "namespace": obj["metadata"]["namespace"]},
+            "firstTimestamp": now, "lastTimestamp": now, "count": 1,
+        }
+        self.events = self.events[-999:] + [event]
+        return event
+
+    def __notify(self, resource: str, event_type: str, obj: dict):
+        obj["metadata"]["resourceVersion"] = self.__next_version()
+        for queue in self.watchers[resource]:
+            queue.append({"type": event_type, "object": obj})
+        if resource != "events":
+            event = self.events[-1]
+            for queue in self.watchers["events"]:
+                queue.append({"type": "ADDED", "object": event})
+        self.watch_condition.notify_all()
+
+    def __list(self, kind: str, items: List[dict]) -> dict:
+        return {"apiVersion": "v1", "kind": kind, "metadata": {"resourceVersion": str(self.resource_version)}, "items": items}
+
+    def handle(self, request, method, path, query, body):
+        not_found = {"kind": "Status", "apiVersion": "v1", "status": "Failure", "reason": "NotFound",
+                     "message": f"{path} not found", "code": 404}
+
+        resources = {"/api/v1/pods": "pods", "/apis/apps/v1/deployments": "deployments", "/api/v1/events": "events"}
+        if path in resources and method == "GET" and query.get("watch") in ("true", "1", "True"):
+            self.__watch(request, resources[path], float(query.get("timeoutSeconds", 60)))
+            return
+        if path == "/apis/apps/v1/deployments" and method == "GET":
+            with self.lock:
+                request.send_json(200, self.__list("DeploymentList", list(self.deployments.values())))
+            return
+        if path == "/api/v1/events" and method == "GET":
+            with self.lock:
+                request.send_json(200, self.__list("EventList", list(self.events)))
+            return
+
+        if path == "/api/v1/pods" and method == "GET":
+            selector = query.get("labelSelector")
+            with self.lock:
+                pods = [p for p in self.pods.values() if not selector or selector == f"app={p['metadata']['labels']['app']}"]
+                request.send_json(200, self.__list("PodList", pods))
+            return
+
+        match = re.fullmatch(r"/api/v1/namespaces/([\w.-]+)/pods(?:/([\w.-]+))?(/log)?", path)
+        if match:
+            namespace, name, log = match.groups()
+            with self.lock:
+                if name is None:
+                    pods = [p for p in self.pods.values() if p["metadata"]["namespace"] == namespace]
+                    request.send_json(200, self.__list("PodList", pods))
+                    return
+                pod = self.pods.get(f"{namespace}/{name}")
+                if pod is None:
+                    request.send_json(404, not_found)
+                elif log:
+                    lines = int(query.get("tailLines", 100))
+                    request.send_text(200, "\n".join(f"{name} log line {i}" for i in range(min(lines, 20))))
+                elif method == "DELETE":
+                    if query.get("dryRun") is None:
+                        del self.pods[f"{namespace}/{name}"]
+                        self.__add_event(pod, "Normal", "Killing", "Stopping container app")
+                        self.__notify("pods", "DELETED", pod)
+                        replacement = self.__add_pod(namespace, pod["metadata"]["labels"]["app"])
+                        self.__add_event(replacement, "Normal", "Scheduled", f"Successfully assigned {namespace}/{replacement['metadata']['name']}")
+                        self.__notify("pods", "ADDED", replacement)
+                    request.send_json(200, pod)
+                else:
+                    request.send_json(200, pod)
+            return
+
+        match = re.fullmatch(r"/apis/apps/v1/namespaces/([\w.-]+)/deployments(?:/([\w.-]+))?(/scale)?", path)
+        if match:
+            namespace, name, scale = match.groups()
+            with self.lock:
+                if name is None:
+                    items = [d for d in self.deployments.values() if d["metadata"]["namespace"] == namespace]
+                    request.send_json(200, self.__list("DeploymentList", items))
+                    return
+                deployment = self.deployments.get(f"{namespace}/{name}")
+                if deployment is None:
+                    request.send_json(404, not_found)
+                    return
+                if method == "PATCH" and isinstance(body, dict) and query.get("dryRun") is None:
+                    if scale:
+                        replicas = body.get("spec", {}).get("replicas", deployment["spec"]["replicas"])
+                        self.__add_event(deployment, "Normal", "ScalingReplicaSet",
+                                         f"Scaled replica set {name}-5d8f from {deployment['spec']['replicas']} to {replicas}")
+                        deployment["spec"]["replicas"] = replicas
+                    else:
+                        annotations = body.get("spec", {}).get("template", {}).get("metadata", {}).get("annotations", {})
+                        deployment["spec"]["template"]["metadata"].setdefault("annotations", {}).update(annotations)
+                        self.__add_event(deployment, "Normal", "ScalingReplicaSet", f"Scaled up replica set {name}-6c9a to 1")
+                    self.__notify("deployments", "MODIFIED", deployment)
+                if scale:
+                    replicas = deployment["spec"]["replicas"]
+                    request.send_json(200, {"apiVersion": "autoscaling/v1", "kind": "Scale", "metadata": deployment["metadata"],
+                                            "spec": {"replicas": replicas}, "status": {"replicas": replicas}})
+                else:
+                    request.send_json(200, deployment)
+            return
+
+        match = re.fullmatch(r"/api/v1/nodes(?:/([\w.-]+))?", path)
+        if match:
+            name = match.group(1)
+            if name is None:
+                request.send_json(200, self.__list("NodeList", [self.__node(n) for n in self.nodes]))
+            elif name in self.nodes:
+                unschedulable = bool((body or {}).get("spec", {}).get("unschedulable")) if method == "PATCH" else False
+                request.send_json(200, self.__node(name, unschedulable))
+            else:
+                request.send_json(404, not_found)
+            return
+
+        request.send_json(404, not_found)
+
+    def __watch(self, request, resource: str, timeout: float):
+        # Watch responses are chunked like the real API server's, clients read every chunk as it arrives
+        request.protocol_version = "HTTP/1.1"
+        request.send_response(200)
+        request.send_header("Content-Type", "application/json")
+        request.send_header("Transfer-Encoding", "chunked")
+        request.send_header("Connection", "close")
+        request.end_headers()
+        queue = []
+        deadline = time.monotonic() + timeout
+        with self.watch_condition:
+            self.watchers[resource].append(queue)
+        try:
+            while True:
+                with self.watch_condition:
+                    while not queue and not self.stopped.is_set() and time.monotonic() < deadline:
+                        self.watch_condition.wait(deadline - time.monotonic())
+                    if not queue:
+                        request.wfile.write(b"0\r\n\r\n")
+                        return
+                    events, queue[:] = list(queue), []
+                data = "".join(json.dumps(event) + "\n" for event in events).encode()
+                request.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+                request.wfile.flush()
+        finally:
+            with self.watch_condition:
+                self.watchers[resource].remove(queue)
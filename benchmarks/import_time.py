@@ -0,0 +1,158 @@
+"""
+Measures the cold-start cost of loading the actions: import time and resident memory, each in a
+fresh interpreter so nothing is cached between runs.
+
+Needs robusta installed, like the Robusta runner loading the playbooks:
+
+    python benchmarks/import_time.py
+    python benchmarks/import_time.py --modules chatgpt_robusta_actions.chat_gpt --repeat 10 --top 15
+    python benchmarks/import_time.py --json imports.json --baseline baseline.json --tolerance 0.25
+
+The first row imports every module of --package like the Robusta runner does when it loads the
+playbooks, the other rows one action module each. Every row is measured --repeat times, the median
+is reported. The heavy dependencies that were loaded by the import are listed, so a client that
+should only load on first use shows up there.
+With --top the slowest imports of one run are listed from python -X importtime. With --baseline
+the run fails when a module takes longer or more memory than the baseline by more than the tolerance.
+"""
+import argparse
+import json
+import os
+import pkgutil
+import statistics
+import subprocess
+import sys
+from typing import List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PACKAGE = "chatgpt_robusta_actions"
+MODULES = ["chatgpt_robusta_actions.chat_gpt", "chatgpt_robusta_actions.amazon_bedrock"]
+# Dependencies that are only needed once an alert is handled
+HEAVY_DEPENDENCIES = ["opsgenie_sdk", "kubernetes", "numpy", "tiktoken", "redis", "requests", "prometheus_client"]
+
+# Runs in the fresh interpreter, prints the measurement as JSON
+PROBE = """
+import json, os, resource, sys, time
+
+def rss_mb():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (2 ** 20 if sys.platform == "darwin" else 2 ** 10)
+
+before = set(sys.modules)
+rss_before = rss_mb()
+start = time.perf_counter()
+for module in sys.argv[1:]:
+    __import__(module)
+elapsed = time.perf_counter() - start
+loaded = [m for m in set(sys.modules) - before if "." not in m]
+print(json.dumps({"import_s": elapsed, "rss_mb": rss_mb(), "rss_growth_mb": rss_mb() - rss_before,
+                  "modules": len(set(sys.modules) - before), "loaded": loaded}))
+"""
+
+
+def package_modules(package: str) -> List[str]:
+    """
+    Returns all modules of the package, the way the Robusta runner finds the playbook modules.
+    """
+    path = os.path.join(ROOT, *package.split("."))
+    return sorted(m.name for m in pkgutil.walk_packages([path], prefix=f"{package}.") if not m.ispkg)
+
+
+def probe(modules: List[str]) -> dict:
+    output = subprocess.run([sys.executable, "-c", PROBE, *modules], cwd=ROOT, capture_output=True, text=True)
+    if output.returncode != 0:
+        raise RuntimeError(f"Importing {modules} failed: {output.stderr.strip().splitlines()[-1]}")
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def slowest_imports(modules: List[str], top: int) -> List[tuple]:
+    """
+    Returns the imports with the highest cumulative time in microseconds, from python -X importtime.
+    """
+    output = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {', '.join(modules)}"], cwd=ROOT,
+                            capture_output=True, text=True)
+    imports = []
+    for line in output.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        imports.append((int(cumulative), name.strip()))
+    return sorted(imports, reverse=True)[:top]
+
+
+def measure(name: str, modules: List[str], repeat: int) -> dict:
+    runs = [probe(modules) for _ in range(repeat)]
+    loaded = set(runs[0]["loaded"])
+    return {
+        "module": name,
+        "import_ms": round(statistics.median(r["import_s"] for r in runs) * 1000, 1),
+        "import_max_ms": round(max(r["import_s"] for r in runs) * 1000, 1),
+        "rss_mb": round(statistics.median(r["rss_mb"] for r in runs), 1),
+        "rss_growth_mb": round(statistics.median(r["rss_growth_mb"] for r in runs), 1),
+        "modules": runs[0]["modules"],
+        "heavy": ",".join(d for d in HEAVY_DEPENDENCIES if d in loaded) or "-",
+    }
+
+
+def compare(results: List[dict], baseline_path: str, tolerance: float) -> List[str]:
+    with open(baseline_path) as f:
+        baseline = {r["module"]: r for r in json.load(f)["modules"]}
+    regressions = []
+    for result in results:
+        base = baseline.get(result["module"])
+        if base is None:
+            continue
+        if result["import_ms"] > base["import_ms"] * (1 + tolerance):
+            regressions.append(f"{result['module']}: import {result['import_ms']}ms, baseline {base['import_ms']}ms")
+        if result["rss_growth_mb"] > base["rss_growth_mb"] * (1 + tolerance):
+            regressions.append(f"{result['module']}: RSS growth {result['rss_growth_mb']}MB, "
+                               f"baseline {base['rss_growth_mb']}MB")
+    return regressions
+
+
+def print_table(results: List[dict]):
+    columns = ["module", "import_ms", "import_max_ms", "rss_mb", "rss_growth_mb", "modules", "heavy"]
+    widths = {c: max(len(c), *(len(str(r.get(c, ""))) for r in results)) for c in columns}
+    print("  ".join(c.ljust(widths[c]) for c in columns))
+    for r in results:
+        print("  ".join(str(r.get(c, "")).ljust(widths[c]) for c in columns))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--package", default=PACKAGE, help="Package whose modules are all imported in the first row")
+    parser.add_argument("--modules", nargs="+", default=MODULES)
+    parser.add_argument("--repeat", type=int, default=5, help="Fresh interpreters per module")
+    parser.add_argument("--top", type=int, default=0, help="Also list the slowest imports of every module")
+    parser.add_argument("--json", help="Write the results to this file")
+    parser.add_argument("--baseline", help="Results file of an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed regression against the baseline")
+    args = parser.parse_args()
+
+    rows = {f"{args.package} (all modules)": package_modules(args.package)} if args.package else {}
+    rows.update({module: [module] for module in args.modules})
+    results = [measure(name, modules, args.repeat) for name, modules in rows.items()]
+    print_table(results)
+    for row, modules in rows.items() if args.top else []:
+        print(f"\nSlowest imports of {row} (cumulative ms):")
+        for cumulative, name in slowest_imports(modules, args.top):
+            print(f"  {cumulative / 1000:8.1f}  {name}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"modules": results, "arguments": vars(args)}, f, indent=2)
+
+    if args.baseline:
+        regressions = compare(results, args.baseline, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,266 @@
+"""
+Replays alert streams through the actions against local fake services and reports throughput,
+latency percentiles and memory per scenario. Nothing leaves the machine, so it runs in CI.
+
+Needs the runtime dependencies of the actions (robusta, kubernetes, opsgenie-sdk, requests):
+
+    python benchmarks/run_benchmarks.py
+    python benchmarks/run_benchmarks.py --rates 100 1000 --duration 20 --llm-latency 2 --llm-error-rate 0.05
+    python benchmarks/run_benchmarks.py --replay alerts.jsonl --actions chat_gpt_enricher
+    python benchmarks/run_benchmarks.py --json results.json --baseline baseline.json --tolerance 0.25
+
+Every scenario sends an alert stream at a fixed rate (alerts per minute) for --duration seconds.
+Synthetic streams cycle through --distinct alerts, so repeated alerts exercise the caches. A
+replay file has one alert per line: {"labels": {...}, "annotations": {...}}. With --baseline the
+run fails when the p99 latency or the throughput of a scenario is worse than the baseline by more
+than the tolerance.
+"""
+import argparse
+import datetime
+import json
+import logging
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from typing import Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fake_services import FakeKubernetesServer, FakeLLMServer, FakeOpsGenieServer, FaultInjection
+
+
+ALERT_NAMES = ["KubePodCrashLooping", "KubeDeploymentReplicasMismatch", "KubePodNotReady",
+               "KubeContainerWaiting", "CPUThrottlingHigh"]
+
+
+class ReplayedAlert(object):
+    """
+    Stands in for robusta's PrometheusKubernetesAlert, with the members the actions use.
+    """
+
+    def __init__(self, labels: Dict[str, str], annotations: Dict[str, str]):
+        self.alert = SimpleNamespace(labels=labels, annotations=annotations,
+                                     startsAt=datetime.datetime.now(datetime.timezone.utc))
+        self.enrichments = []
+
+    def get_title(self) -> str:
+        return self.alert.annotations.get("summary", self.alert.labels.get("alertname", ""))
+
+    def get_description(self) -> str:
+        return self.alert.annotations.get("description", "")
+
+    def add_enrichment(self, blocks):
+        self.enrichments.append(blocks)
+
+
+def synthetic_alerts(distinct: int, cluster: FakeKubernetesServer) -> List[dict]:
+    deployments = sorted(cluster.deployments)
+    alerts = []
+    for i in range(distinct):
+        namespace, deployment = deployments[i % len(deployments)].split("/")
+        alertname = ALERT_NAMES[i % len(ALERT_NAMES)]
+        alerts.append({
+            "labels": {"alertname": alertname, "cluster": "benchmark", "namespace": namespace,
+                       "deployment": deployment, "severity": "warning" if i % 3 else "critical"},
+            "annotations": {"summary": f"{alertname} in {namespace}/{deployment}",
+                            "description": f"{deployment} in namespace {namespace} is not healthy."},
+        })
+    return alerts
+
+
+def load_replay(path: str) -> List[dict]:
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+
+
+def rss_mb() -> float:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except (OSError, ValueError):
+        # ru_maxrss is the peak, in KiB on Linux and bytes on macOS
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (2 ** 20 if sys.platform == "darwin" else 2 ** 10)
+
+
+def build_actions(args, llm: FakeLLMServer, opsgenie: FakeOpsGenieServer):
+    """
+    Imports the actions, after the kubeconfig of the fake cluster is in place.
+    """
+    from chatgpt_robusta_actions.amazon_bedrock import BedrockParameters, amazon_bedrock_enricher
+    from chatgpt_robusta_actions.chat_gpt import ChatGPTTokenParams, chat_gpt_enricher
+
+    common = dict(use_cache=not args.no_cache, llm_backoff_base_seconds=0.1, llm_backoff_max_seconds=2,
+                  azure_openai_requests_per_minute=args.llm_requests_per_minute,
+                  azure_openai_tokens_per_minute=args.llm_tokens_per_minute,
+                  bedrock_requests_per_minute=args.llm_requests_per_minute,
+                  bedrock_tokens_per_minute=args.llm_tokens_per_minute)
+    chat_params = ChatGPTTokenParams(
+        azure_openai_token="benchmark", azure_openai_api_base=llm.url, azure_openai_deployment_id="benchmark",
+        opsgenie_key="benchmark", opsgenie_host=opsgenie.url, opsgenie_team="benchmark",
+        stream_responses=args.stream, batch_window_seconds=args.batch_window, **common)
+    bedrock_params = BedrockParameters(
+        search_term="", bedrock_token="benchmark", bedrock_api_base=f"{llm.url}/bedrock",
+        bedrock_deployment_id="benchmark", **common)
+    return {
+        "chat_gpt_enricher": (chat_gpt_enricher, chat_params),
+        "amazon_bedrock_enricher": (amazon_bedrock_enricher, bedrock_params),
+    }
+
+
+def run_scenario(name: str, action, params, alerts: List[dict], rate: float, duration: float, workers: int,
+                 trace_memory: bool) -> dict:
+    count = max(1, int(rate * duration / 60))
+    interval = 60.0 / rate
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    def handle(alert: dict, scheduled: float):
+        labels = {**alert["labels"], "benchmark_scenario": name}
+        try:
+            action(ReplayedAlert(labels, dict(alert.get("annotations", {}))), params)
+        except Exception as e:
+            with lock:
+                errors.append(repr(e))
+        with lock:
+            # Measured from the scheduled arrival, so time spent queueing for a worker counts too
+            latencies.append(time.monotonic() - scheduled)
+
+    if trace_memory:
+        tracemalloc.start()
+    rss_before = rss_mb()
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="benchmark") as executor:
+        for i in range(count):
+            scheduled = start + i * interval
+            time.sleep(max(0.0, scheduled - time.monotonic()))
+            executor.submit(handle, alerts[i % len(alerts)], scheduled)
+    elapsed = time.monotonic() - start
+
+    result = {
+        "scenario": name, "alerts": count, "errors": len(errors), "elapsed_s": round(elapsed, 2),
+        "throughput_per_s": round(count / elapsed, 2) if elapsed else 0.0,
+        "p50_s": round(percentile(latencies, 0.5), 3), "p99_s": round(percentile(latencies, 0.99), 3),
+        "max_s": round(max(latencies, default=0.0), 3),
+        "rss_mb": round(rss_mb(), 1), "rss_growth_mb": round(rss_mb() - rss_before, 1),
+    }
+    if trace_memory:
+        result["traced_peak_mb"] = round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 1)
+        tracemalloc.stop()
+    if errors:
+        logging.warning(f"{name}: {len(errors)} alert(s) failed, first error: {errors[0]}")
+    return result
+
+
+def compare(results: List[dict], baseline_path: str, tolerance: float) -> List[str]:
+    with open(baseline_path) as f:
+        baseline = {r["scenario"]: r for r in json.load(f)["scenarios"]}
+    regressions = []
+    for result in results:
+        base = baseline.get(result["scenario"])
+        if base is None:
+            continue
+        if base["p99_s"] and result["p99_s"] > base["p99_s"] * (1 + tolerance):
+            regressions.append(f"{result['scenario']}: p99 {result['p99_s']}s, baseline {base['p99_s']}s")
+        if result["throughput_per_s"] < base["throughput_per_s"] * (1 - tolerance):
+            regressions.append(f"{result['scenario']}: throughput {result['throughput_per_s']}/s, "
+                               f"baseline {base['throughput_per_s']}/s")
+    return regressions
+
+
+def print_table(results: List[dict]):
+    columns = ["scenario", "alerts", "errors", "throughput_per_s", "p50_s", "p99_s", "max_s", "rss_mb", "rss_growth_mb"]
+    if any("traced_peak_mb" in r for r in results):
+        columns.append("traced_peak_mb")
+    widths = {c: max(len(c), *(len(str(r.get(c, ""))) for r in results)) for c in columns}
+    print("  ".join(c.ljust(widths[c]) for c in columns))
+    for r in results:
+        print("  ".join(str(r.get(c, "")).ljust(widths[c]) for c in columns))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--actions", nargs="+", default=["chat_gpt_enricher", "amazon_bedrock_enricher"])
+    parser.add_argument("--rates", nargs="+", type=float, default=[1, 100, 1000], help="Alerts per minute")
+    parser.add_argument("--duration", type=float, default=60, help="Seconds of alert stream per scenario")
+    parser.add_argument("--replay", help="JSON lines file of alerts to replay instead of synthetic ones")
+    parser.add_argument("--distinct", type=int, default=50, help="Distinct synthetic alerts")
+    parser.add_argument("--workers", type=int, default=64, help="Concurrently running actions")
+    parser.add_argument("--stream", action="store_true", help="Stream ChatGPT answers")
+    parser.add_argument("--no-cache", action="store_true", help="Disable the LLM answer cache")
+    parser.add_argument("--batch-window", type=float, default=2, help="Alert batching window in seconds")
+    parser.add_argument("--llm-latency", type=float, default=1.0)
+    parser.add_argument("--llm-error-rate", type=float, default=0.0)
+    parser.add_argument("--llm-error-status", type=int, default=429)
+    parser.add_argument("--llm-requests-per-minute", type=int, help="LLM request quota enforced by the actions")
+    parser.add_argument("--llm-tokens-per-minute", type=int, help="LLM token quota enforced by the actions")
+    parser.add_argument("--opsgenie-latency", type=float, default=0.05)
+    parser.add_argument("--opsgenie-error-rate", type=float, default=0.0)
+    parser.add_argument("--opsgenie-processing-delay", type=float, default=0.2)
+    parser.add_argument("--k8s-latency", type=float, default=0.01)
+    parser.add_argument("--k8s-error-rate", type=float, default=0.0)
+    parser.add_argument("--tracemalloc", action="store_true", help="Also report the traced Python heap peak (slower)")
+    parser.add_argument("--json", help="Write the results to this file")
+    parser.add_argument("--baseline", help="Results file of an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed regression against the baseline")
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args()
+    logging.basicConfig(level=args.log_level, format="%(asctime)s %(levelname)s %(message)s")
+
+    llm = FakeLLMServer(FaultInjection(args.llm_latency, error_rate=args.llm_error_rate,
+                                       error_status=args.llm_error_status)).start()
+    opsgenie = FakeOpsGenieServer(FaultInjection(args.opsgenie_latency, error_rate=args.opsgenie_error_rate),
+                                  processing_delay=args.opsgenie_processing_delay).start()
+    cluster = FakeKubernetesServer(FaultInjection(args.k8s_latency, error_rate=args.k8s_error_rate)).start()
+
+    kubeconfig = tempfile.NamedTemporaryFile("w", prefix="benchmark-kubeconfig-", suffix=".json", delete=False)
+    json.dump(cluster.kubeconfig(), kubeconfig)
+    kubeconfig.close()
+    os.environ["KUBECONFIG"] = kubeconfig.name
+    os.environ.pop("KUBERNETES_SERVICE_HOST", None)
+
+    actions = build_actions(args, llm, opsgenie)
+    alerts = load_replay(args.replay) if args.replay else synthetic_alerts(args.distinct, cluster)
+
+    results = []
+    try:
+        for action_name in args.actions:
+            action, params = actions[action_name]
+            for rate in args.rates:
+                name = f"{action_name}@{rate:g}/min"
+                logging.info(f"Running {name}...")
+                results.append(run_scenario(name, action, params, alerts, rate, args.duration, args.workers,
+                                            args.tracemalloc))
+    finally:
+        os.unlink(kubeconfig.name)
+
+    print_table(results)
+    services = {"llm": llm.stats(), "opsgenie": opsgenie.stats(), "kubernetes": cluster.stats()}
+    print(f"Requests to the fake services: {json.dumps(services)}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"scenarios": results, "services": services, "arguments": vars(args)}, f, indent=2)
+
+    if args.baseline:
+        regressions = compare(results, args.baseline, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+import datetime
+import threading
+import time
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+
+from .fingerprint import alert_fingerprint
+from .instrumentation import CACHE_LOOKUPS
+
+
+class AlertItem(NamedTuple):
+    labels: Dict[str, str]
+    title: str
+    description: str
+    starts_at: Optional[datetime.datetime] = None
+
+
+def batch_key(item: AlertItem, group_labels: Optional[List[str]] = None,
+              volatile_labels: Optional[List[str]] = None) -> str:
+    """
+    Alerts with the same key are analyzed together: the values of group_labels if given,
+    otherwise the alert fingerprint.
+    """
+    if group_labels:
+        return "|".join(f"{label}={item.labels.get(label, '')}" for label in group_labels)
+    return alert_fingerprint(item.labels, item.title, item.description, volatile_labels)
+
+
+def alert_identity(item: AlertItem) -> str:
+    """
+    Identifies one alert by its complete label set, like Alertmanager does. Only repeated
+    notifications of the same alert share it, other pods of the same problem do not.
+    """
+    return "|".join(f"{key}={value}" for key, value in sorted(item.labels.items()))
+
+
+def combine_sections(items: List[AlertItem]) -> Dict[str, str]:
+    """
+    Merges the prompt sections of a group of alerts: labels shared by all alerts are listed once,
+    the differing ones with all their values, titles and descriptions without duplicates.
+    """
+    shared = {k: v for k, v in items[0].labels.items() if all(i.labels.get(k) == v for i in items[1:])}
+    differing = sorted({k for i in items for k in i.labels} - shared.keys())
+    labels = [f"{key}: {value}" for key, value in shared.items()]
+    labels += [f"{key}: {' | '.join(dict.fromkeys(i.labels[key] for i in items if key in i.labels))}" for key in differing]
+    if len(items) > 1:
+        labels.append(f"alerts in group: {len(items)}")
+    return {
+        "labels": ", ".join(labels),
+        "title": "\n".join(dict.fromkeys(i.title for i in items if i.title)),
+        "description": "\n".join(dict.fromkeys(i.description for i in items if i.description)),
+    }
+
+
+class _Batch(object):
+    def __init__(self):
+        self.items: List[AlertItem] = []
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class AlertBatcher(object):
+    """
+    Collects alerts with the same key for a short window and analyzes each group once.
+
+    The first alert of a group waits window seconds for more alerts to join and then runs process
+    on all of them, every alert of the group receives the same result. An alert processed within
+    the last dedup_ttl seconds is not processed again, its repeated notifications get the previous
+    result. Results that cacheable rejects, e.g. ones carrying an error, are not reused.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.batches: Dict[str, _Batch] = {}
+        self.recent: Dict[str, tuple] = {}
+        self.batched = 0
+        self.deduplicated = 0
+
+    def submit(self, key: str, item: AlertItem, window: float, dedup_ttl: float,
+               process: Callable[[List[AlertItem]], Any], cacheable: Optional[Callable[[Any], bool]] = None) -> Any:
+        """
+        :param key: Batch key of the alert, see batch_key
+        :param cacheable: Whether a result may be reused for repeated notifications, all results by default
+        """
+        identity = alert_identity(item)
+        now = time.monotonic()
+        with self.lock:
+            self.recent = {k: v for k, v in self.recent.items() if v[0] > now}
+            if identity in self.recent:
+                self.deduplicated += 1
+                CACHE_LOOKUPS.labels("alert_batch", "deduplicated").inc()
+                return self.recent[identity][1]
+
+            batch = self.batches.get(key)
+            leader = batch is None
+            if leader:
+                batch = _Batch()
+                self.batches[key] = batch
+            else:
+                self.batched += 1
+                CACHE_LOOKUPS.labels("alert_batch", "batched").inc()
+            batch.items.append(item)
+
+        if not leader:
+            batch.done.wait()
+            if batch.error is not None:
+                raise batch.error
+            return batch.result
+
+        try:
+            try:
+                time.sleep(window)
+            finally:
+                with self.lock:
+                    # Alerts arriving from now on start a new batch
+                    del self.batches[key]
+            batch.result = process(batch.items)
+            if dedup_ttl > 0 and (cacheable is None or cacheable(batch.result)):
+                expires = time.monotonic() + dedup_ttl
+                with self.lock:
+                    for analyzed in batch.items:
+                        self.recent[alert_identity(analyzed)] = (expires, batch.result)
+            return batch.result
+        except BaseException as e:
+            batch.error = e
+            raise
+        finally:
+            batch.done.set()
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            return {"batched": self.batched, "deduplicated": self.deduplicated, "open_batches": len(self.batches)}
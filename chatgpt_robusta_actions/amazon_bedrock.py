@@ -1,16 +1,27 @@
 import logging
 import json
-import requests
+from typing import Dict
 
-import cachetools
-from robusta.api import *
+from robusta.api import JsonBlock, PrometheusKubernetesAlert, action
 
-cache_size = 100
-lru_cache = cachetools.LRUCache(maxsize=cache_size)
+from .fingerprint import alert_fingerprint
+from .instrumentation import log_payload, span, start_metrics_server
+from .llm_admission import severity_priority
+from .llm_backend import LLMBackendParams, query_llm
+from .prompt_builder import PromptBuilder
 
 
-class BedrockParameters(ActionParams):
+BEDROCK_PROMPT = PromptBuilder(
+    ["You are a helpful assistant. Provide kubectl commands only, no explanations!"],
+    "Can you analyze the alert and make a Kubernetes command to solve it? Provide only the command, no explanation!"
+)
+
+
+class BedrockParameters(LLMBackendParams):
     search_term: str
+    fingerprint: str = ""
+    severity: str = ""
+    labels: Dict[str, str] = {}
     model: str = "gpt-3.5-turbo"
     bedrock_token: str
     bedrock_api_base: str
@@ -18,43 +29,26 @@ class BedrockParameters(ActionParams):
 
 
 def query_bedrock(params: BedrockParameters):
-    bedrock_api_base = params.bedrock_api_base
-    bedrock_token = params.bedrock_token
-    deployment_id = params.bedrock_deployment_id
     search_term = params.search_term
 
-    logging.info(f"Bedrock search term: {search_term}")
+    logging.debug(f"Bedrock search term: {search_term}")
+
+    with span("prompt", "build_prompt"):
+        prompt = BEDROCK_PROMPT.build({"labels": search_term}, params.prompt_token_budget)
+    input = prompt.messages
+    logging.info(f"Bedrock prompt has {prompt.token_count} tokens")
 
     answers = []
     try:
-        if search_term in lru_cache:
-            answers = lru_cache[search_term]
-        else:
-            logging.info(f"Bedrock input: {input}")
-
-            # TODO: most likely  these parameters
-            url = f"{bedrock_api_base}/{deployment_id}"
-            headers = {
-                'Content-Type': 'application/json',
-                'Authentication': f"Bearer {bedrock_token}"
-                }
-            data = {'request': f"You are a helpful assistant. Provide kubectl commands only, no explanations! Can you analyze the alert and make a Kubernetes command to solve it? Provide only the command, no explanation!\n{search_term}"}
-            # ---------------
-
-            res = requests.post(url, headers=headers, json=data)
-
-            if res:
-                logging.info(f"Bedrock response: {res}")
-                response_content = res.choices[0].message.content
-                lru_cache[params.search_term] = [response_content]
-                answers.append(response_content)
-            else:
-                logging.error(f"Got no Bedrock response!")
-
+        log_payload(f"Bedrock input: {input}", params.log_payload_sample_rate)
+        with span("llm", "query_bedrock"):
+            answers = query_llm(params, "bedrock", f"bedrock:{params.fingerprint or search_term}", input,
+                                severity_priority(params.severity), params.labels)
+        log_payload(f"Bedrock response: {answers}", params.log_payload_sample_rate)
     except Exception as e:
         answers.append(f"Error trying to query Bedrock: {e}")
         raise
-    
+
     return answers
 
 
@@ -64,20 +58,19 @@ def amazon_bedrock_enricher(alert: PrometheusKubernetesAlert, params: BedrockPar
     Add a button to the alert - clicking it will ask chat gpt to help find a solution.
     """
 
+    start_metrics_server(params.metrics_port)
     alert_name = alert.alert.labels.get("alertname", "")
-    print (alert)
-    print ('XXX')
-    print(alert.alert)
+    log_payload(f"Bedrock enricher received alert: {alert.alert}", params.log_payload_sample_rate)
 
     if not alert_name:
         return
 
-    action_params = BedrockParameters(
-        search_term=f"{alert_name}",
-        bedrock_token=params.bedrock_token,
-        bedrock_api_base=params.bedrock_api_base,
-        bedrock_deployment_id=params.bedrock_deployment_id
-    )
+    action_params = params.copy(update={
+        "search_term": f"{alert_name}",
+        "fingerprint": alert_fingerprint(alert.alert.labels, volatile_labels=params.cache_volatile_labels),
+        "severity": alert.alert.labels.get("severity", ""),
+        "labels": alert.alert.labels,
+    })
 
     answers = query_bedrock(action_params)
 
@@ -0,0 +1,229 @@
+import datetime
+import logging
+import threading
+import time
+from collections import deque
+from typing import TYPE_CHECKING, Dict, List, NamedTuple, Optional
+
+from .cluster_context import Informer, PodSummary, get_api_client, get_pod_informer
+from .prompt_builder import count_tokens
+
+if TYPE_CHECKING:
+    from kubernetes import client
+
+
+DEFAULT_MAX_ENTRIES = 5000
+# Normal events worth reporting next to all warnings
+NOTABLE_NORMAL_EVENT_REASONS = {"ScalingReplicaSet", "Killing", "Preempting", "SuccessfulDelete", "SuccessfulRescale"}
+
+_journal_lock = threading.Lock()
+_journal = None
+
+
+class Change(NamedTuple):
+    timestamp: float
+    namespace: str
+    kind: str
+    name: str
+    description: str
+
+    def to_line(self) -> str:
+        at = datetime.datetime.fromtimestamp(self.timestamp, datetime.timezone.utc).strftime("%H:%M:%SZ")
+        return f"{at} {self.kind} {self.name}: {self.description}"
+
+
+class DeploymentSummary(NamedTuple):
+    images: str
+    replicas: int
+    ready: int
+    restarted_at: str
+
+    @staticmethod
+    def of(deployment: "client.V1Deployment") -> "DeploymentSummary":
+        template = deployment.spec.template
+        annotations = (template.metadata.annotations if template.metadata else None) or {}
+        return DeploymentSummary(
+            images=",".join(c.image or "" for c in template.spec.containers or []),
+            replicas=deployment.spec.replicas or 0,
+            ready=(deployment.status.ready_replicas or 0) if deployment.status else 0,
+            restarted_at=annotations.get("kubectl.kubernetes.io/restartedAt", ""),
+        )
+
+
+def describe_pod_change(event_type: str, old: Optional[PodSummary], new: Optional[PodSummary]) -> str:
+    if event_type == "DELETED" or new is None:
+        return f"deleted (was {old.status})" if old else "deleted"
+    if old is None:
+        return f"created on {new.node}, {new.status} {new.ready}"
+    details = []
+    if new.status != old.status:
+        details.append(f"{old.status} -> {new.status}")
+    if new.restarts > old.restarts:
+        details.append(f"restarted {new.restarts - old.restarts}x (total {new.restarts})")
+    if new.ready != old.ready:
+        details.append(f"ready {old.ready} -> {new.ready}")
+    if new.node != old.node:
+        details.append(f"scheduled on {new.node}")
+    return ", ".join(details)
+
+
+def describe_deployment_change(old: Optional[DeploymentSummary], new: DeploymentSummary) -> str:
+    if old is None:
+        return f"created with {new.replicas} replicas, image {new.images}"
+    details = []
+    if new.images != old.images:
+        details.append(f"image {old.images} -> {new.images}")
+    if new.replicas != old.replicas:
+        details.append(f"scaled {old.replicas} -> {new.replicas}")
+    if new.restarted_at != old.restarted_at:
+        details.append("rollout restarted")
+    if new.ready != old.ready:
+        details.append(f"ready {old.ready}/{old.replicas} -> {new.ready}/{new.replicas}")
+    return ", ".join(details)
+
+
+def event_timestamp(event: "client.CoreV1Event") -> float:
+    at = event.last_timestamp or event.event_time or event.first_timestamp or event.metadata.creation_timestamp
+    return at.timestamp() if at else time.time()
+
+
+class ChangeJournal(object):
+    """
+    A bounded ring buffer of recent cluster changes: pod and deployment transitions seen by their
+    watches, and Kubernetes warning events. Prompts get the changes of the alert's namespace around
+    the time it started instead of a full snapshot of the cluster.
+    """
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.changes = deque(maxlen=max_entries)
+        self.lock = threading.Lock()
+
+    def record(self, change: Change):
+        with self.lock:
+            self.changes.append(change)
+
+    def changes_around(self, namespace: str, at: float, before: float, after: float) -> List[Change]:
+        with self.lock:
+            changes = [c for c in self.changes if c.namespace == namespace and at - before <= c.timestamp <= at + after]
+        return sorted(changes, key=lambda c: c.timestamp)
+
+    def render(self, changes: List[Change], token_budget: int) -> str:
+        """
+        Lists the changes oldest first, repeated identical ones once with their count. When over
+        budget the oldest changes are left out, the ones closest to the alert are the most telling.
+        """
+        lines: Dict[tuple, list] = {}
+        for change in changes:
+            entry = lines.setdefault((change.kind, change.name, change.description), [change, 0])
+            entry[0], entry[1] = change, entry[1] + 1
+        rendered = [c.to_line() + (f" (x{n})" if n > 1 else "")
+                    for c, n in sorted(lines.values(), key=lambda e: e[0].timestamp)]
+
+        kept = []
+        used = 0
+        for line in reversed(rendered):
+            cost = count_tokens(line) + 1
+            if used + cost > token_budget:
+                kept.append(f"... {len(rendered) - len(kept)} earlier changes omitted")
+                break
+            kept.append(line)
+            used += cost
+        return "\n".join(reversed(kept))
+
+    def on_pod_change(self, event_type: str, old: Optional[PodSummary], new: Optional[PodSummary]):
+        pod = new or old
+        description = describe_pod_change(event_type, old, new)
+        if description:
+            self.record(Change(time.time(), pod.namespace, "pod", pod.name, description))
+
+
+class DeploymentInformer(Informer):
+    def __init__(self, api_client: "client.ApiClient", journal: ChangeJournal):
+        from kubernetes import client
+
+        super().__init__(client.AppsV1Api(api_client).list_deployment_for_all_namespaces, "deployment-informer")
+        self.journal = journal
+        self.deployments: Dict[str, DeploymentSummary] = {}
+
+    def on_list(self, items: list):
+        with self.lock:
+            self.deployments = {f"{d.metadata.namespace}/{d.metadata.name}": DeploymentSummary.of(d) for d in items}
+
+    def on_event(self, event_type: str, deployment: "client.V1Deployment"):
+        key = f"{deployment.metadata.namespace}/{deployment.metadata.name}"
+        summary = DeploymentSummary.of(deployment)
+        with self.lock:
+            old = self.deployments.pop(key, None) if event_type == "DELETED" else self.deployments.get(key)
+            if event_type != "DELETED":
+                self.deployments[key] = summary
+        description = "deleted" if event_type == "DELETED" else describe_deployment_change(old, summary)
+        if description:
+            self.journal.record(Change(time.time(), deployment.metadata.namespace, "deployment",
+                                       deployment.metadata.name, description))
+
+
+class EventInformer(Informer):
+    def __init__(self, api_client: "client.ApiClient", journal: ChangeJournal):
+        from kubernetes import client
+
+        super().__init__(client.CoreV1Api(api_client).list_event_for_all_namespaces, "event-informer")
+        self.journal = journal
+        # Resource version of every recorded event by uid, so relists do not record them again
+        self.recorded: Dict[str, str] = {}
+
+    def on_list(self, items: list):
+        # Events carry their own timestamps, so the initial list already gives some history. Relists
+        # after a 410 Gone return the same events, only those that changed since are recorded.
+        uids = {event.metadata.uid for event in items}
+        with self.lock:
+            self.recorded = {uid: version for uid, version in self.recorded.items() if uid in uids}
+        for event in items:
+            self.on_event("ADDED", event)
+
+    def on_event(self, event_type: str, event: "client.CoreV1Event"):
+        if event_type == "DELETED":
+            with self.lock:
+                self.recorded.pop(event.metadata.uid, None)
+            return
+        if event.type != "Warning" and event.reason not in NOTABLE_NORMAL_EVENT_REASONS:
+            return
+        with self.lock:
+            if self.recorded.get(event.metadata.uid) == event.metadata.resource_version:
+                return
+            self.recorded[event.metadata.uid] = event.metadata.resource_version
+        involved = event.involved_object
+        self.journal.record(Change(event_timestamp(event), event.metadata.namespace, (involved.kind or "").lower(),
+                                   involved.name or "", f"{event.type} {event.reason}: {event.message}"))
+
+
+def get_change_journal(max_entries: int = DEFAULT_MAX_ENTRIES) -> ChangeJournal:
+    """
+    Returns the journal shared by all actions, starting its watches on first use.
+    """
+    global _journal
+    with _journal_lock:
+        if _journal is None:
+            journal = ChangeJournal(max_entries)
+            api_client = get_api_client()
+            get_pod_informer().add_listener(journal.on_pod_change)
+            DeploymentInformer(api_client, journal).start()
+            EventInformer(api_client, journal).start()
+            _journal = journal
+        return _journal
+
+
+def get_alert_changes(namespace: str, starts_at: Optional[datetime.datetime], before_seconds: float,
+                      after_seconds: float, token_budget: int) -> str:
+    """
+    Returns the changes in the namespace from before_seconds before to after_seconds after the
+    alert started (or now), capped at roughly token_budget tokens.
+    """
+    if not namespace:
+        return ""
+    at = starts_at.timestamp() if starts_at else time.time()
+    try:
+        journal = get_change_journal()
+    except Exception as e:
+        logging.error(f"Unable to collect cluster changes: {e}")
+        return ""
+    return journal.render(journal.changes_around(namespace, at, before_seconds, after_seconds), token_budget)
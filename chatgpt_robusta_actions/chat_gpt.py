@@ -1,85 +1,124 @@
 import logging
 import json
-import subprocess
 
 import os
-import requests
+from typing import Dict, Iterator, List, Optional
 
-import cachetools
-import openai
-from openai.openai_object import OpenAIObject
-from robusta.api import *
+from robusta.api import MarkdownBlock, PrometheusKubernetesAlert, action
 
-from .opsGenieAlerting import OpsGenieAlerting
+from .alert_batching import AlertBatcher, AlertItem, batch_key, combine_sections
+from .change_journal import get_alert_changes
+from .cluster_context import get_alert_context
+from .command_extractor import KubectlCommandExtractor, extract_kubectl_commands
+from .exceptions import DeadlineExceededError, LLMBackendsExhaustedError
+from .fingerprint import alert_fingerprint
+from .instrumentation import CACHE_LOOKUPS, log_payload, span, start_metrics_server
+from .knowledge_base import get_knowledge_base
+from .kubectl_executor import KubectlParams, run_kubectl_command
+from .llm_admission import severity_priority
+from .llm_backend import LLMBackendParams, query_llm, stream_llm
+from .opsGenieAlerting import getOpsGenieClient
+from .pipeline import AlertPipeline
+from .prompt_builder import PromptBuilder
 
 
-cache_size = 100
-lru_cache = cachetools.LRUCache(maxsize=cache_size)
-use_cache = False
+CHATGPT_PROMPT = PromptBuilder(
+    [
+        "You are a helpful assistant. Provide kubectl commands only, no explanations!",
+        "Provide a runnable kubectl command without placeholders!",
+        "Don't provide kubectl commands that do not modify anything, i.e., no kubectl describe.",
+    ],
+    "Can you analyze the alert and make a kubectl command to resolve the alert? Provide only the command, no explanation!"
+)
 
 
-class ChatGPTTokenParams(ActionParams):
+alert_batcher = AlertBatcher()
+# Answers of enrichments that ran out of time or LLM backends start with this
+INCOMPLETE_PREFIX = "Enrichment incomplete: "
+
+
+class ChatGPTTokenParams(LLMBackendParams, KubectlParams):
+    """
+    :var batch_window_seconds: Wait this long for related alerts and analyze them together
+    :var batch_group_labels: Labels whose values define a group of related alerts, defaults to the alert fingerprint
+    :var dedup_ttl_seconds: Repeated notifications of an analyzed alert (same labels) within this time reuse its answer
+    :var opsgenie_retry_count: Retries of throttled and failed OpsGenie requests
+    :var opsgenie_retry_max_delay_seconds: Time after which an OpsGenie request is no longer retried
+    :var use_change_journal: Send the recent changes in the alert's namespace instead of a pod listing,
+        the listing is only sent when no changes were recorded
+    :var changes_before_seconds: Changes from this long before the alert started are included
+    :var changes_after_seconds: Changes up to this long after the alert started are included
+    :var use_knowledge_base: Answer alerts similar to earlier ones whose kubectl commands succeeded
+        with the earlier answer instead of asking ChatGPT, needs numpy
+    :var knowledge_base_threshold: Minimum cosine similarity of the normalized alert texts for a match
+    :var knowledge_base_path: sqlite file keeping the knowledge base across restarts, in memory only if not set
+    :var knowledge_base_max_entries: Number of answers kept, the oldest are dropped first
+    """
     azure_openai_token: str
     azure_openai_api_base: str
     azure_openai_deployment_id: str
     opsgenie_key: str
+    opsgenie_host: str = "https://api.eu.opsgenie.com"
+    opsgenie_team: str = "ARIS Ops Test"
+    opsgenie_request_timeout: float = 10
+    opsgenie_connection_pool_size: int = 10
+    opsgenie_retry_count: int = 2
+    opsgenie_retry_max_delay_seconds: float = 10
+    context_token_budget: int = 1500
+    alert_deadline_seconds: float = 120
+    context_concurrency: int = 8
+    llm_concurrency: int = 4
+    kubectl_concurrency: int = 4
+    opsgenie_concurrency: int = 8
+    stream_responses: bool = False
+    batch_window_seconds: float = 2
+    batch_group_labels: Optional[List[str]] = None
+    dedup_ttl_seconds: float = 300
+    use_change_journal: bool = True
+    changes_before_seconds: float = 900
+    changes_after_seconds: float = 120
+    use_knowledge_base: bool = True
+    knowledge_base_threshold: float = 0.9
+    knowledge_base_path: Optional[str] = None
+    knowledge_base_max_entries: int = 5000
 
 
 class ChatGPTParams(ChatGPTTokenParams):
     """
     :var search_term: ChatGPT search term
     :var model: ChatGPT OpenAi API model
+    :var fingerprint: Normalized alert fingerprint, identical alerts share one ChatGPT call
+    :var trace_id: Trace the spans of this enrichment are logged with
+    :var severity: Alert severity, more severe alerts get LLM quota first
+    :var labels: Alert labels, the object names in shared and cached answers are taken from them
     """
     search_term: str
+    fingerprint: str = ""
+    trace_id: str = ""
+    severity: str = ""
+    labels: Dict[str, str] = {}
     # model: str = "gpt-3.5-turbo"
     model: str = "gpt-4"
 
 
-def get_pods():
-    return subprocess.getoutput('kubectl get pods -A')
-
-
-def query_chatgtp(params: ChatGPTParams, system=[]):
-    openai.api_type = "azure"
-    openai.api_base = params.azure_openai_api_base
-    openai.api_version = "2023-05-15"
-    openai.api_key = params.azure_openai_token
-    deployment_id = params.azure_openai_deployment_id
+def query_chatgtp(params: ChatGPTParams, sections: Dict[str, str] = {}):
+    """
+    :param sections: Prompt sections by name (labels, title, description, changes, pods, events, logs),
+        defaults to the search term as labels
+    """
+    logging.debug(f"ChatGPT search term: {params.search_term}")
 
-    print(f"ChatGPT search term: {params.search_term}")
+    with span("prompt", "build_prompt", params.trace_id):
+        prompt = CHATGPT_PROMPT.build(sections or {"labels": params.search_term}, params.prompt_token_budget)
+    input = prompt.messages
+    logging.info(f"ChatGPT prompt has {prompt.token_count} tokens")
 
     answers = []
     try:
-        if use_cache and params.search_term in lru_cache:
-            answers = lru_cache[params.search_term]
-        else:
-            input = [
-                {"role": "system", "content": "You are a helpful assistant. Provide kubectl commands only, no explanations!"},
-                {"role": "system", "content": "Provide a runnable kubectl command without placeholders!"},
-                {"role": "system", "content": "Don't provide kubectl commands that do not modify anything, i.e., no kubectl describe."},
-                *[{"role": "system", "content": f"Use this as context information: {system_cmd}"}
-                    for system_cmd in system],
-                {"role": "user",
-                 "content": f"Can you analyze the alert and make a kubectl command to resolve the alert? Provide only the command, no explanation!\n{params.search_term}"}
-            ]
-
-            print(f"ChatGPT input: {input}")
-            res: OpenAIObject = openai.ChatCompletion.create(
-                deployment_id=deployment_id,
-                model=params.model,
-                messages=input,
-                max_tokens=1000,
-                temperature=0
-            )
-            if res:
-                print(f"ChatGPT response: {res}")
-                response_content = res.choices[0].message.content
-                # Store only the main response in the cache
-                lru_cache[params.search_term] = [response_content]
-                answers.append(response_content)
-            else:
-                logging.error(f"Got no ChatGPT response!")
-
+        log_payload(f"ChatGPT input: {input}", params.log_payload_sample_rate)
+        answers = query_llm(params, "azure", f"chatgpt:{params.fingerprint or params.search_term}", input,
+                            severity_priority(params.severity), params.labels)
+        log_payload(f"ChatGPT response: {answers}", params.log_payload_sample_rate)
     except Exception as e:
         answers.append(f"Error calling ChatCompletion.create: {e}")
         raise
@@ -87,44 +126,186 @@ def query_chatgtp(params: ChatGPTParams, system=[]):
     return answers
 
 
-def runKubectlCommand(cmd):
-    return subprocess.getoutput(cmd)
+def stream_chatgtp(params: ChatGPTParams, sections: Dict[str, str] = {}) -> Iterator[str]:
+    """
+    Like query_chatgtp, but yields the answer in chunks as it is generated.
+    """
+    with span("prompt", "build_prompt", params.trace_id):
+        prompt = CHATGPT_PROMPT.build(sections or {"labels": params.search_term}, params.prompt_token_budget)
+    logging.info(f"ChatGPT prompt has {prompt.token_count} tokens")
+    log_payload(f"ChatGPT input: {prompt.messages}", params.log_payload_sample_rate)
+    yield from stream_llm(params, "azure", f"chatgpt:{params.fingerprint or params.search_term}", prompt.messages,
+                          severity_priority(params.severity), params.labels)
 
 
-@action
-def chat_gpt_enricher(alert: PrometheusKubernetesAlert, params: ChatGPTTokenParams):
-    pods = get_pods()
+def runKubectlCommand(cmd, params: KubectlParams = None):
+    return run_kubectl_command(cmd, params)
+
+
+def stage_limits(params: ChatGPTTokenParams) -> Dict[str, int]:
+    return {
+        "context": params.context_concurrency,
+        "llm": params.llm_concurrency,
+        "kubectl": params.kubectl_concurrency,
+        "opsgenie": params.opsgenie_concurrency,
+    }
+
+
+def lookup_opsgenie_alerts(params: ChatGPTTokenParams, items: List[AlertItem]):
+    # opsgenie_sdk is imported when the first client is created
+    try:
+        opsGenieAlerting = getOpsGenieClient(
+            params.opsgenie_host, params.opsgenie_key, params.opsgenie_team, True, params.opsgenie_request_timeout,
+            connectionPoolSize=params.opsgenie_connection_pool_size, retryCount=params.opsgenie_retry_count,
+            retryMaxDelay=params.opsgenie_retry_max_delay_seconds)
+    except ImportError as e:
+        logging.warning(f"OpsGenie is skipped, install the 'opsgenie' extra to post GenAI help to alerts: {e}")
+        return None, []
+    alerts = {}
+    for cluster, alertname in dict.fromkeys((i.labels['cluster'], i.labels['alertname']) for i in items):
+        for a in opsGenieAlerting.getOpenAlertsByTagsAndContainingMessage(tags=[cluster], containingMessage=alertname):
+            alerts[a.id] = a
+    return opsGenieAlerting, list(alerts.values())
 
-    search_term = ", ".join(
-        [f"{key}: {value}" for key, value in alert.alert.labels.items()])
-    search_term = f"{search_term}\n{alert.get_title()}\n{alert.get_description()}"
-    print('XXX')
-    print("XXX Labels: ", search_term)
 
-    if not search_term:
+def post_opsgenie_notes(opsgenie_lookup, note: str):
+    opsGenieAlerting, alerts = opsgenie_lookup.result()
+    if opsGenieAlerting is None:
         return
+    notes = opsGenieAlerting.bulkAddNoteToAlerts(alerts, note, "IW test")
+    if not notes.ok:
+        logging.error(f"Unable to add GenAI help to OpsGenie alerts: {notes.failed}")
+
+
+def stream_and_execute_commands(pipeline: AlertPipeline, action_params: ChatGPTParams, sections: Dict[str, str],
+                                opsgenie_lookup):
+    """
+    Streams the ChatGPT answer and starts every kubectl command as soon as its line is complete.
+    The result of each command is posted to the OpsGenie alerts right away.
+
+    Returns the answer text, the futures of the kubectl runs and the list the note futures are added to.
+    """
+    note_futures = []
+
+    def execute(command: str) -> str:
+        kubectlResponse = runKubectlCommand(command, action_params)
+        note_futures.append(pipeline.submit(
+            "opsgenie", post_opsgenie_notes, opsgenie_lookup,
+            f"GenAI generated help: {json.dumps([command, 'Kubectl run response: ' + kubectlResponse])}"))
+        return kubectlResponse
+
+    extractor = KubectlCommandExtractor()
+    chunks = []
+    runs = []
+    for chunk in stream_chatgtp(action_params, sections):
+        chunks.append(chunk)
+        runs.extend(pipeline.submit("kubectl", execute, command) for command in extractor.feed(chunk))
+    runs.extend(pipeline.submit("kubectl", execute, command) for command in extractor.finish())
+    return "".join(chunks), runs, note_futures
+
+
+def enrich_alerts(items: List[AlertItem], params: ChatGPTTokenParams) -> List[str]:
+    """
+    Analyzes a group of related alerts with a single prompt and returns the answers for all of them.
+    """
+    pipeline = AlertPipeline(params.alert_deadline_seconds, stage_limits(params))
+    with span("alert", "enrich_alerts", pipeline.trace_id, alerts=len(items)):
+        return _enrich_alerts(pipeline, items, params)
+
+
+def _enrich_alerts(pipeline: AlertPipeline, items: List[AlertItem], params: ChatGPTTokenParams) -> List[str]:
+    labels = items[0].labels
+
+    # The OpsGenie lookup does not depend on the LLM answer, so it runs alongside it
+    opsgenie_lookup = pipeline.submit("opsgenie", lookup_opsgenie_alerts, params, items)
+
+    knowledge_base = get_knowledge_base(params.knowledge_base_path, params.knowledge_base_max_entries) \
+        if params.use_knowledge_base else None
+    known_answer = None
+    if knowledge_base is not None:
+        with span("knowledge_base", "lookup", pipeline.trace_id):
+            known_answer = knowledge_base.lookup(labels, items[0].title, items[0].description,
+                                                 params.knowledge_base_threshold, params.cache_volatile_labels)
+        CACHE_LOOKUPS.labels("knowledge_base", "miss" if known_answer is None else "hit").inc()
+
+    changes = ""
+    if params.use_change_journal and known_answer is None:
+        starts_at = min((i.starts_at for i in items if i.starts_at), default=None)
+        changes = pipeline.run("context", get_alert_changes, labels.get("namespace", ""), starts_at,
+                               params.changes_before_seconds, params.changes_after_seconds,
+                               params.context_token_budget)
+    pods = "" if changes or known_answer is not None else \
+        pipeline.run("context", get_alert_context, labels, params.context_token_budget)
+
+    sections = {**combine_sections(items), "changes": changes, "pods": pods}
+    search_term = f"{sections['labels']}\n{sections['title']}\n{sections['description']}"
+    logging.debug(f"Enriching {len(items)} alert(s) '{labels.get('alertname')}', trace {pipeline.trace_id}")
 
     action_params = ChatGPTParams(
+        **params.dict(),
         search_term=f"{search_term}",
-        azure_openai_token=params.azure_openai_token,
-        azure_openai_api_base=params.azure_openai_api_base,
-        azure_openai_deployment_id=params.azure_openai_deployment_id,
-        opsgenie_key=""
+        fingerprint=alert_fingerprint(labels, items[0].title, items[0].description, params.cache_volatile_labels),
+        trace_id=pipeline.trace_id,
+        labels=labels,
+        # The group is as urgent as its most severe alert
+        severity=min((i.labels.get("severity", "") for i in items), key=severity_priority)
     )
 
-    answers = query_chatgtp(action_params, [pods])
+    answers = []
+    try:
+        if params.stream_responses and known_answer is None:
+            text, runs, note_futures = pipeline.run(
+                "llm", stream_and_execute_commands, pipeline, action_params, sections, opsgenie_lookup)
+            answers = [text]
+            answers.extend("Kubectl run response: " + pipeline.wait(run) for run in runs)
+            if not runs:
+                # Nothing was posted while streaming, post the answer like the non-streaming path does
+                answers.append("Kubectl run response: no kubectl command found in the answer")
+                pipeline.wait(opsgenie_lookup)
+                note_futures.append(pipeline.submit("opsgenie", post_opsgenie_notes, opsgenie_lookup,
+                                                    f"GenAI generated help: {json.dumps(answers)}"))
+            for note in note_futures:
+                pipeline.wait(note)
+        else:
+            answers = [known_answer] if known_answer is not None else \
+                pipeline.run("llm", query_chatgtp, action_params, sections)
+
+            commands = extract_kubectl_commands(answers[0]) if answers else []
+            runs = [pipeline.submit("kubectl", runKubectlCommand, command, params) for command in commands]
+            answers.extend("Kubectl run response: " + pipeline.wait(run) for run in runs)
+            if not commands:
+                answers.append("Kubectl run response: no kubectl command found in the answer")
+
+            pipeline.wait(opsgenie_lookup)
+            pipeline.run("opsgenie", post_opsgenie_notes, opsgenie_lookup,
+                         f"GenAI generated help: {json.dumps(answers)}")
+
+        if knowledge_base is not None and known_answer is None and answers:
+            outcomes = [a[len("Kubectl run response: "):] for a in answers[1:]]
+            knowledge_base.add(labels, items[0].title, items[0].description, answers[0], outcomes,
+                               params.cache_volatile_labels)
+    except (DeadlineExceededError, LLMBackendsExhaustedError) as e:
+        logging.error(f"Enrichment for alert '{labels.get('alertname')}' incomplete: {e}")
+        answers.append(f"{INCOMPLETE_PREFIX}{e}")
+
+    return answers
+
+
+def is_complete(answers: List[str]) -> bool:
+    return not any(a.startswith(INCOMPLETE_PREFIX) for a in answers)
 
-    kubectlResponse = runKubectlCommand(answers[0])
-    answers.append("Kubectl run response: " + kubectlResponse)
 
-    opsGenieAlerting = OpsGenieAlerting(
-        "https://api.eu.opsgenie.com", params.opsgenie_key, "ARIS Ops Test", True, 10)
-    alerts = opsGenieAlerting.getOpenAlertsByTagsAndContainingMessage(
-        tags=[alert.alert.labels['cluster']], containingMessage=alert.alert.labels['alertname'])
+@action
+def chat_gpt_enricher(alert: PrometheusKubernetesAlert, params: ChatGPTTokenParams):
+    start_metrics_server(params.metrics_port)
+    item = AlertItem(alert.alert.labels, alert.get_title(), alert.get_description(), alert.alert.startsAt)
+    if not (item.labels or item.title or item.description):
+        return
 
-    for a in alerts:
-        opsGenieAlerting.addNoteToAlert(
-            a, f"GenAI generated help: {json.dumps(answers)}", "IW test")
+    key = batch_key(item, params.batch_group_labels, params.cache_volatile_labels)
+    answers = alert_batcher.submit(key, item, params.batch_window_seconds, params.dedup_ttl_seconds,
+                                   lambda items: enrich_alerts(items, params), is_complete)
+    logging.debug(f"Alert batching stats: {alert_batcher.stats()}")
 
     alert.add_enrichment(
         [
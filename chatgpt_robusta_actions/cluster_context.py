@@ -0,0 +1,289 @@
+import logging
+import threading
+import time
+from typing import TYPE_CHECKING, Dict, List, NamedTuple, Optional
+
+from .prompt_builder import count_tokens
+
+if TYPE_CHECKING:
+    from kubernetes import client
+
+INFORMER_SYNC_TIMEOUT = 5
+WATCH_TIMEOUT_SECONDS = 300
+
+WORKLOAD_LABELS = ["deployment", "statefulset", "daemonset", "replicaset", "job_name", "cronjob", "workload"]
+NODE_LABELS = ["node", "kubernetes_node", "nodename"]
+
+_api_client_lock = threading.Lock()
+_api_client: Optional["client.ApiClient"] = None
+
+_informer_lock = threading.Lock()
+_pod_informer = None
+
+
+def get_api_client() -> "client.ApiClient":
+    """
+    Returns the in-process Kubernetes API client shared by all actions. The Kubernetes client
+    package is only imported here and where the API is called, not when the playbooks are loaded.
+    """
+    from kubernetes import client, config
+
+    global _api_client
+    with _api_client_lock:
+        if _api_client is None:
+            try:
+                config.load_incluster_config()
+            except config.ConfigException:
+                config.load_kube_config()
+            _api_client = client.ApiClient()
+        return _api_client
+
+
+class PodSummary(NamedTuple):
+    namespace: str
+    name: str
+    ready: str
+    status: str
+    restarts: int
+    node: str
+    owner: str
+    labels: Dict[str, str]
+
+    @property
+    def healthy(self) -> bool:
+        ready, _, total = self.ready.partition("/")
+        return self.status in ("Running", "Succeeded") and ready == total
+
+    def to_line(self) -> str:
+        return f"{self.namespace} {self.name} {self.ready} {self.status} {self.restarts} {self.node}"
+
+
+def summarize_pod(pod: "client.V1Pod") -> PodSummary:
+    statuses = pod.status.container_statuses or []
+    ready = sum(1 for s in statuses if s.ready)
+    restarts = sum(s.restart_count or 0 for s in statuses)
+
+    # Prefer the waiting/terminated reason (e.g. CrashLoopBackOff) over the phase, like kubectl does
+    status = pod.status.reason or pod.status.phase or "Unknown"
+    for s in statuses:
+        if s.state and s.state.waiting and s.state.waiting.reason:
+            status = s.state.waiting.reason
+            break
+        if s.state and s.state.terminated and s.state.terminated.reason:
+            status = s.state.terminated.reason
+    if pod.metadata.deletion_timestamp:
+        status = "Terminating"
+
+    owners = pod.metadata.owner_references or []
+    return PodSummary(
+        namespace=pod.metadata.namespace,
+        name=pod.metadata.name,
+        ready=f"{ready}/{len(pod.spec.containers or [])}",
+        status=status,
+        restarts=restarts,
+        node=pod.spec.node_name or "<none>",
+        owner=owners[0].name if owners else "",
+        labels=dict(pod.metadata.labels or {}),
+    )
+
+
+class Informer(object):
+    """
+    Follows a Kubernetes list function: an initial list, then a watch from its resource version.
+    The list is repeated when the watch falls too far behind (410 Gone) or fails.
+
+    Subclasses receive the full list in on_list() and every change in on_event().
+    """
+
+    def __init__(self, list_fn, name: str):
+        self.list_fn = list_fn
+        self.lock = threading.Lock()
+        self.synced = threading.Event()
+        self.thread = threading.Thread(target=self.__run, name=name, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def wait_for_sync(self, timeout: float) -> bool:
+        return self.synced.wait(timeout)
+
+    def on_list(self, items: list):
+        raise NotImplementedError()
+
+    def on_event(self, event_type: str, obj):
+        raise NotImplementedError()
+
+    def __relist(self) -> str:
+        object_list = self.list_fn()
+        self.on_list(object_list.items)
+        self.synced.set()
+        return object_list.metadata.resource_version
+
+    def __run(self):
+        from kubernetes import watch
+        from kubernetes.client.rest import ApiException
+
+        resource_version = None
+        while True:
+            try:
+                if resource_version is None:
+                    resource_version = self.__relist()
+                w = watch.Watch()
+                for event in w.stream(self.list_fn, resource_version=resource_version,
+                                      timeout_seconds=WATCH_TIMEOUT_SECONDS):
+                    resource_version = event["object"].metadata.resource_version
+                    self.on_event(event["type"], event["object"])
+            except ApiException as e:
+                if e.status == 410:
+                    # Our resource version is too old, start over with a fresh list
+                    resource_version = None
+                    continue
+                logging.warning(f"{self.thread.name} watch failed: {e}")
+                time.sleep(1)
+            except Exception as e:
+                logging.warning(f"{self.thread.name} watch failed: {e}")
+                resource_version = None
+                time.sleep(1)
+
+
+class PodInformer(Informer):
+    """
+    Keeps an in-memory copy of all pods in the cluster. Listeners are called with the event type
+    and the old and new summary of every pod that changed, also for changes found by a relist.
+    """
+
+    def __init__(self, api_client: "client.ApiClient"):
+        from kubernetes import client
+
+        self.core_v1 = client.CoreV1Api(api_client)
+        super().__init__(self.core_v1.list_pod_for_all_namespaces, "pod-informer")
+        self.pods: Dict[str, PodSummary] = {}
+        self.listeners = []
+
+    def add_listener(self, listener):
+        with self.lock:
+            self.listeners.append(listener)
+
+    def list(self) -> List[PodSummary]:
+        with self.lock:
+            return list(self.pods.values())
+
+    def on_list(self, items: list):
+        pods = {f"{p.metadata.namespace}/{p.metadata.name}": summarize_pod(p) for p in items}
+        with self.lock:
+            old, self.pods = self.pods, pods
+            listeners = list(self.listeners) if self.synced.is_set() else []
+        for listener in listeners:
+            for key in old.keys() | pods.keys():
+                if old.get(key) != pods.get(key):
+                    event_type = "ADDED" if key not in old else "DELETED" if key not in pods else "MODIFIED"
+                    listener(event_type, old.get(key), pods.get(key))
+
+    def on_event(self, event_type: str, pod: "client.V1Pod"):
+        key = f"{pod.metadata.namespace}/{pod.metadata.name}"
+        summary = summarize_pod(pod)
+        with self.lock:
+            old = self.pods.get(key)
+            if event_type == "DELETED":
+                self.pods.pop(key, None)
+            else:
+                self.pods[key] = summary
+            listeners = list(self.listeners)
+        for listener in listeners:
+            listener(event_type, old, summary)
+
+
+def get_pod_informer() -> PodInformer:
+    global _pod_informer
+    with _informer_lock:
+        if _pod_informer is None:
+            _pod_informer = PodInformer(get_api_client())
+            _pod_informer.start()
+        return _pod_informer
+
+
+class AlertScope(NamedTuple):
+    namespace: str
+    pod: str
+    workload: str
+    node: str
+
+    @staticmethod
+    def from_labels(labels: Dict[str, str]) -> "AlertScope":
+        workload = next((labels[l] for l in WORKLOAD_LABELS if labels.get(l)), "")
+        node = next((labels[l] for l in NODE_LABELS if labels.get(l)), "")
+        return AlertScope(
+            namespace=labels.get("namespace", ""),
+            pod=labels.get("pod", ""),
+            workload=workload,
+            node=node,
+        )
+
+    def relevance(self, pod: PodSummary) -> int:
+        """
+        Scores how closely a pod relates to the alert, 0 means not related at all.
+        """
+        if self.pod and pod.name == self.pod and pod.namespace == self.namespace:
+            return 4
+        if self.workload and pod.namespace == self.namespace and (
+                pod.owner == self.workload or pod.owner.startswith(f"{self.workload}-")
+                or pod.name.startswith(f"{self.workload}-")):
+            return 3
+        if self.node and pod.node == self.node:
+            return 2
+        if self.namespace and pod.namespace == self.namespace:
+            return 1
+        return 0
+
+
+def _list_scoped_pods(scope: AlertScope) -> List[PodSummary]:
+    informer = get_pod_informer()
+    if informer.wait_for_sync(INFORMER_SYNC_TIMEOUT):
+        return informer.list()
+
+    # The informer did not finish its first list yet, fall back to a narrow API call
+    logging.warning("Pod informer not synced yet, listing pods directly")
+    from kubernetes import client
+
+    core_v1 = client.CoreV1Api(get_api_client())
+    if scope.namespace:
+        pods = core_v1.list_namespaced_pod(scope.namespace).items
+    elif scope.node:
+        pods = core_v1.list_pod_for_all_namespaces(field_selector=f"spec.nodeName={scope.node}").items
+    else:
+        return []
+    return [summarize_pod(p) for p in pods]
+
+
+def get_alert_context(labels: Dict[str, str], token_budget: int = 1500) -> str:
+    """
+    Returns a kubectl-like pod listing scoped to the alert's namespace, workload and node,
+    most relevant and unhealthy pods first, capped at roughly token_budget tokens.
+    """
+    scope = AlertScope.from_labels(labels)
+    if not (scope.namespace or scope.node):
+        return ""
+
+    try:
+        pods = _list_scoped_pods(scope)
+    except Exception as e:
+        logging.error(f"Unable to collect cluster context: {e}")
+        return ""
+
+    scored = [(scope.relevance(p), p) for p in pods]
+    scored = [(score, p) for score, p in scored if score > 0]
+    scored.sort(key=lambda sp: (-sp[0], sp[1].healthy, -sp[1].restarts, sp[1].namespace, sp[1].name))
+
+    header = "NAMESPACE NAME READY STATUS RESTARTS NODE"
+    lines = [header]
+    used = count_tokens(header)
+    for i, (_, pod) in enumerate(scored):
+        line = pod.to_line()
+        cost = count_tokens(line) + 1
+        if used + cost > token_budget:
+            lines.append(f"... {len(scored) - i} more pods omitted")
+            break
+        lines.append(line)
+        used += cost
+
+    return "\n".join(lines) if len(lines) > 1 else ""
@@ -0,0 +1,38 @@
+import re
+from typing import List
+
+
+# Shell prompts and markdown decoration models like to put around commands
+_DECORATION = re.compile(r"^(?:```\w*|`|\$\s+|>\s+|\d+[.)]\s+|[-*]\s+)+")
+
+
+class KubectlCommandExtractor(object):
+    """
+    Picks complete kubectl command lines out of a streamed LLM answer.
+
+    feed() takes the next chunk of text and returns the commands whose line was completed by it,
+    finish() returns the command on the last line once the stream has ended.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+
+    @staticmethod
+    def parse_line(line: str) -> str:
+        line = _DECORATION.sub("", line.strip()).rstrip("`").strip()
+        return line if line.startswith("kubectl ") else ""
+
+    def feed(self, chunk: str) -> List[str]:
+        self.buffer += chunk
+        *lines, self.buffer = self.buffer.split("\n")
+        return [command for command in map(self.parse_line, lines) if command]
+
+    def finish(self) -> List[str]:
+        line, self.buffer = self.buffer, ""
+        command = self.parse_line(line)
+        return [command] if command else []
+
+
+def extract_kubectl_commands(text: str) -> List[str]:
+    extractor = KubectlCommandExtractor()
+    return extractor.feed(text) + extractor.finish()
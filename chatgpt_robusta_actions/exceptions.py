@@ -11,3 +11,33 @@ class ResponseCheckRetryError(Exception):
             self.message = f"{message}{os.linesep}"
         self.message += f"The maximum number of retries ({str(maxRetryCounter)}) was reached!"
         super().__init__(self.message)
+
+class DeadlineExceededError(Exception):
+    def __init__(self, stage: str, deadline: float):
+        self.stage = stage
+        self.message = f"The alert deadline of {deadline} seconds was exceeded in stage '{stage}'!"
+        super().__init__(self.message)
+
+class LLMRequestError(Exception):
+    def __init__(self, url: str, status_code: int = None, message: str = ""):
+        self.status_code = status_code
+        self.message = f"LLM request to '{url}' failed with status '{status_code}': {message}"
+        super().__init__(self.message)
+
+class LLMBackendsExhaustedError(Exception):
+    def __init__(self, errors=[]):
+        self.errors = errors
+        self.message = "No LLM backend is configured!" if not errors else f"All LLM backends failed: {'; '.join(errors)}"
+        super().__init__(self.message)
+
+class KubectlCommandError(Exception):
+    def __init__(self, command: str, reason: str):
+        self.command = command
+        self.message = f"Refusing to run '{command}': {reason}"
+        super().__init__(self.message)
+
+class LLMQuotaExceededError(Exception):
+    def __init__(self, backend: str, waited: float):
+        self.backend = backend
+        self.message = f"No quota for LLM backend '{backend}' after waiting {waited:.1f} seconds!"
+        super().__init__(self.message)
@@ -0,0 +1,66 @@
+import hashlib
+import re
+from typing import Dict, Iterable, Optional
+
+
+# Labels that differ between firings of what is really the same problem
+DEFAULT_VOLATILE_LABELS = [
+    "pod", "pod_name", "instance", "pod_ip", "container_id", "uid", "endpoint",
+    "prometheus", "prometheus_replica", "replica", "fingerprint", "startsAt", "endsAt",
+]
+# Labels naming the affected objects. Their values become placeholders in reused answers, which are
+# filled in with the labels of the alert the answer is reused for.
+ENTITY_LABELS = [
+    "pod", "pod_name", "container", "namespace", "node", "kubernetes_node", "instance",
+    "deployment", "statefulset", "daemonset", "replicaset", "job_name", "cronjob", "service", "persistentvolumeclaim",
+]
+
+_placeholder = re.compile(r"<<(\w+)>>")
+
+
+def alert_fingerprint(labels: Dict[str, str], title: str = "", description: str = "",
+                      volatile_labels: Optional[Iterable[str]] = None) -> str:
+    """
+    Returns a stable fingerprint of an alert, ignoring volatile labels.
+
+    Values of volatile labels are also masked in the title and description, so
+    "Pod default/web-7d9f-abc is crash looping" and "Pod default/web-7d9f-xyz ..." match.
+    """
+    volatile = set(DEFAULT_VOLATILE_LABELS if volatile_labels is None else volatile_labels)
+
+    for key in sorted(volatile):
+        value = labels.get(key)
+        if value:
+            title = title.replace(value, f"<{key}>")
+            description = description.replace(value, f"<{key}>")
+
+    canonical = "\n".join(
+        [f"{key}={value}" for key, value in sorted(labels.items()) if key not in volatile]
+        + [title.strip(), description.strip()]
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def entity_pattern(value: str):
+    # Only whole names, so deployment "web" does not match inside pod "web-7d9f-abc12"
+    return re.compile(rf"(?<![\w.-]){re.escape(value)}(?![\w.-])")
+
+
+def to_template(answer: str, labels: Dict[str, str]) -> str:
+    """
+    Replaces the names of the alert's objects in an answer with placeholders, so it can be reused
+    for other alerts of the same kind with fill_template.
+    """
+    for key, value in sorted(labels.items(), key=lambda kv: -len(kv[1] or "")):
+        if key in ENTITY_LABELS and value:
+            answer = entity_pattern(value).sub(f"<<{key}>>", answer)
+    return answer
+
+
+def fill_template(template: str, labels: Dict[str, str]) -> Optional[str]:
+    """
+    Returns the answer for an alert with the given labels, or None if it lacks a label the answer refers to.
+    """
+    if any(not labels.get(key) for key in _placeholder.findall(template)):
+        return None
+    return _placeholder.sub(lambda m: labels[m.group(1)], template)
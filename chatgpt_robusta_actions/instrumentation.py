@@ -0,0 +1,112 @@
+import json
+import logging
+import random
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Optional
+
+try:
+    from prometheus_client import REGISTRY, Counter, Histogram, start_http_server
+except ImportError:
+    REGISTRY = Counter = Histogram = start_http_server = None
+
+
+class _NoopMetric(object):
+    def labels(self, *args, **kwargs):
+        return self
+
+    def inc(self, amount: float = 1):
+        pass
+
+    def observe(self, value: float):
+        pass
+
+
+def _registered(name: str, create):
+    # A reloaded module would register the metrics a second time, which the default registry rejects
+    existing = REGISTRY._names_to_collectors.get(name)
+    return existing if existing is not None else create()
+
+
+def _counter(name: str, documentation: str, labels=()):
+    if Counter is None:
+        return _NoopMetric()
+    return _registered(name, lambda: Counter(name, documentation, labels))
+
+
+def _histogram(name: str, documentation: str, labels=()):
+    if Histogram is None:
+        return _NoopMetric()
+    return _registered(name, lambda: Histogram(name, documentation, labels, buckets=DURATION_BUCKETS))
+
+
+DURATION_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+
+STAGE_DURATION = _histogram("chatgpt_robusta_stage_duration_seconds", "Duration of the enrichment steps",
+                            ["stage", "step"])
+STAGE_ERRORS = _counter("chatgpt_robusta_stage_errors_total", "Enrichment steps that raised", ["stage", "step"])
+LLM_TOKENS = _counter("chatgpt_robusta_llm_tokens_total", "LLM tokens used", ["backend", "kind"])
+LLM_BACKEND_ERRORS = _counter("chatgpt_robusta_llm_backend_errors_total", "Failed LLM backend requests", ["backend"])
+CACHE_LOOKUPS = _counter("chatgpt_robusta_cache_lookups_total", "Cache lookups by result", ["cache", "result"])
+CACHE_EVICTIONS = _counter("chatgpt_robusta_cache_evictions_total", "Cache entries evicted, expired or over the size limit",
+                           ["cache", "reason"])
+RETRIES = _counter("chatgpt_robusta_retries_total", "Retried requests", ["target"])
+OPSGENIE_STATUS_POLLS = _counter("chatgpt_robusta_opsgenie_status_polls_total", "OpsGenie request status polls")
+OPSGENIE_COMPLETION = _histogram("chatgpt_robusta_opsgenie_completion_seconds",
+                                 "Time until an OpsGenie write was processed")
+
+span_logger = logging.getLogger("chatgpt_robusta_actions.trace")
+
+_server_lock = threading.Lock()
+_server_port: Optional[int] = None
+
+
+def start_metrics_server(port: Optional[int]):
+    """
+    Serves the metrics on their own /metrics endpoint. Without a port they are only part of the
+    default registry, which the Robusta runner already exposes.
+    """
+    global _server_port
+    if not port or start_http_server is None:
+        return
+    with _server_lock:
+        if _server_port is None:
+            start_http_server(port)
+            _server_port = port
+
+
+def new_trace_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+
+@contextmanager
+def span(stage: str, step: str = "", trace_id: str = "", **attributes):
+    """
+    Times a step of the enrichment, records it in the stage histograms and logs it as a structured span.
+    """
+    start = time.monotonic()
+    status = "ok"
+    try:
+        yield
+    except BaseException:
+        status = "error"
+        STAGE_ERRORS.labels(stage, step or stage).inc()
+        raise
+    finally:
+        duration = time.monotonic() - start
+        STAGE_DURATION.labels(stage, step or stage).observe(duration)
+        if span_logger.isEnabledFor(logging.DEBUG):
+            span_logger.debug(json.dumps({
+                "trace_id": trace_id, "stage": stage, "step": step or stage,
+                "duration_ms": round(duration * 1000, 1), "status": status, **attributes
+            }, default=str))
+
+
+def log_payload(message: str, sample_rate: float):
+    """
+    Logs full prompts and responses at debug level, only for a sample of the requests.
+    """
+    if sample_rate > 0 and random.random() < sample_rate:
+        logging.debug(message)
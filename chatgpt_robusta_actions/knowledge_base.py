@@ -0,0 +1,201 @@
+import json
+import logging
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Dict, Iterable, List, NamedTuple, Optional
+
+from .fingerprint import DEFAULT_VOLATILE_LABELS, ENTITY_LABELS, entity_pattern, fill_template, to_template
+
+
+VECTOR_DIMENSIONS = 512
+DEFAULT_MAX_ENTRIES = 5000
+# Outcomes of kubectl runs that did not do what the answer intended
+FAILED_OUTCOME_PREFIXES = ("Error", "Refusing", "Unable", "no kubectl command")
+
+# numpy is imported with the first knowledge base, not when the playbooks are loaded
+np = None
+
+
+def _load_numpy() -> bool:
+    global np
+    if np is None:
+        try:
+            import numpy
+        except ImportError:
+            return False
+        np = numpy
+    return True
+
+
+def normalize_alert_text(labels: Dict[str, str], title: str, description: str,
+                         volatile_labels: Optional[Iterable[str]] = None) -> str:
+    """
+    Returns the alert as lowercase text without object names, ids and numbers, so the same problem
+    on different pods, nodes or namespaces reads the same.
+    """
+    ignored = set(DEFAULT_VOLATILE_LABELS if volatile_labels is None else volatile_labels) | set(ENTITY_LABELS)
+    text = "\n".join([title, description])
+    for key, value in sorted(labels.items(), key=lambda kv: -len(kv[1] or "")):
+        if key in ENTITY_LABELS and value:
+            text = entity_pattern(value).sub(f"<{key}>", text)
+    parts = [f"{key}={value}" for key, value in sorted(labels.items()) if key not in ignored]
+    parts += [f"{key}=<{key}>" for key in sorted(labels) if key in ENTITY_LABELS]
+    text = "\n".join(parts + [text]).lower()
+    text = re.sub(r"\b[0-9a-f]{8,}\b|\b[0-9a-f-]{36}\b", "<id>", text)
+    return re.sub(r"\d+(\.\d+)?", "0", text)
+
+
+def vectorize(text: str):
+    """
+    Hashes the words and word pairs of the text into a unit length vector, so that the dot product
+    of two vectors is their cosine similarity.
+    """
+    _load_numpy()
+    words = re.findall(r"<\w+>|[a-z_]+|0", text)
+    features = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+    vector = np.zeros(VECTOR_DIMENSIONS, dtype=np.float32)
+    for feature in features:
+        vector[zlib.crc32(feature.encode("utf-8")) % VECTOR_DIMENSIONS] += 1
+    vector = np.log1p(vector)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class KnowledgeEntry(NamedTuple):
+    alertname: str
+    text: str
+    answer: str
+    outcomes: List[str]
+    created: float
+
+    @property
+    def successful(self) -> bool:
+        return bool(self.outcomes) and not any(o.startswith(FAILED_OUTCOME_PREFIXES) for o in self.outcomes)
+
+
+class KnowledgeBase(object):
+    """
+    Past answers of the LLM together with the outcome of their kubectl commands, indexed by the
+    normalized alert text. A new alert with the same name and a close enough text gets the answer
+    of the most similar past alert whose commands succeeded, with the object names of the new alert.
+
+    The vectors of all entries form one matrix, so a lookup is a single matrix-vector product. The
+    matrix grows with the entries, beyond max_entries the oldest ones are replaced. With a path the
+    entries are kept in a sqlite database and survive restarts.
+    """
+
+    def __init__(self, path: Optional[str] = None, max_entries: int = DEFAULT_MAX_ENTRIES):
+        _load_numpy()
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.entries: List[KnowledgeEntry] = []
+        self.vectors = np.zeros((0, VECTOR_DIMENSIONS), dtype=np.float32)
+        self.usable = np.zeros(0, dtype=bool)
+        self.alertnames = np.empty(0, dtype=object)
+        self.count = 0
+        self.next = 0
+        self.hits = 0
+        self.misses = 0
+
+        self.conn = None
+        if path:
+            self.conn = sqlite3.connect(path, check_same_thread=False)
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS knowledge_base (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                "alertname TEXT NOT NULL, text TEXT NOT NULL, answer TEXT NOT NULL, outcomes TEXT NOT NULL, "
+                "created REAL NOT NULL)")
+            self.conn.commit()
+            rows = self.conn.execute(
+                "SELECT alertname, text, answer, outcomes, created FROM knowledge_base ORDER BY id DESC LIMIT ?",
+                (max_entries,)).fetchall()
+            for alertname, text, answer, outcomes, created in reversed(rows):
+                self.__insert(KnowledgeEntry(alertname, text, answer, json.loads(outcomes), created))
+
+    def __grow(self):
+        capacity = min(self.max_entries, max(64, 2 * len(self.vectors)))
+        self.vectors = np.concatenate([self.vectors, np.zeros((capacity - len(self.vectors), VECTOR_DIMENSIONS), dtype=np.float32)])
+        self.usable = np.concatenate([self.usable, np.zeros(capacity - len(self.usable), dtype=bool)])
+        self.alertnames = np.concatenate([self.alertnames, np.empty(capacity - len(self.alertnames), dtype=object)])
+
+    def __insert(self, entry: KnowledgeEntry):
+        i = self.next
+        if i >= len(self.vectors):
+            self.__grow()
+        if i < len(self.entries):
+            self.entries[i] = entry
+        else:
+            self.entries.append(entry)
+        self.vectors[i] = vectorize(entry.text)
+        self.usable[i] = entry.successful
+        self.alertnames[i] = entry.alertname
+        self.next = (i + 1) % self.max_entries
+        self.count = min(self.count + 1, self.max_entries)
+
+    def lookup(self, labels: Dict[str, str], title: str, description: str, threshold: float,
+               volatile_labels: Optional[Iterable[str]] = None) -> Optional[str]:
+        """
+        Returns the answer of the most similar past alert, if its similarity reaches threshold.
+        """
+        vector = vectorize(normalize_alert_text(labels, title, description, volatile_labels))
+        alertname = labels.get("alertname", "")
+        with self.lock:
+            candidates = self.usable[:self.count] & (self.alertnames[:self.count] == alertname)
+            if candidates.any():
+                similarities = np.where(candidates, self.vectors[:self.count] @ vector, -1.0)
+                # Most similar first, the best match may refer to a label this alert does not have
+                for i in np.argsort(-similarities)[:5]:
+                    if similarities[i] < threshold:
+                        break
+                    answer = fill_template(self.entries[i].answer, labels)
+                    if answer is not None:
+                        self.hits += 1
+                        logging.debug(f"Knowledge base match for '{alertname}' with similarity {similarities[i]:.3f}")
+                        return answer
+            self.misses += 1
+            return None
+
+    def add(self, labels: Dict[str, str], title: str, description: str, answer: str, outcomes: List[str],
+            volatile_labels: Optional[Iterable[str]] = None):
+        entry = KnowledgeEntry(
+            alertname=labels.get("alertname", ""),
+            text=normalize_alert_text(labels, title, description, volatile_labels),
+            answer=to_template(answer, labels),
+            outcomes=outcomes,
+            created=time.time(),
+        )
+        with self.lock:
+            self.__insert(entry)
+            if self.conn is not None:
+                self.conn.execute(
+                    "INSERT INTO knowledge_base (alertname, text, answer, outcomes, created) VALUES (?, ?, ?, ?, ?)",
+                    (entry.alertname, entry.text, entry.answer, json.dumps(entry.outcomes), entry.created))
+                self.conn.execute(
+                    "DELETE FROM knowledge_base WHERE id IN "
+                    "(SELECT id FROM knowledge_base ORDER BY id DESC LIMIT -1 OFFSET ?)", (self.max_entries,))
+                self.conn.commit()
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            return {"entries": self.count, "usable": int(self.usable[:self.count].sum()),
+                    "hits": self.hits, "misses": self.misses}
+
+
+_knowledge_bases_lock = threading.Lock()
+_knowledge_bases: Dict[tuple, KnowledgeBase] = {}
+
+
+def get_knowledge_base(path: Optional[str], max_entries: int = DEFAULT_MAX_ENTRIES) -> Optional[KnowledgeBase]:
+    """
+    Returns the knowledge base shared by all actions, or None when numpy is not installed.
+    """
+    if not _load_numpy():
+        logging.debug("numpy is not installed, the knowledge base is disabled")
+        return None
+    key = (path or "", max_entries)
+    with _knowledge_bases_lock:
+        if key not in _knowledge_bases:
+            _knowledge_bases[key] = KnowledgeBase(path, max_entries)
+        return _knowledge_bases[key]
@@ -0,0 +1,291 @@
+import datetime
+import shlex
+from typing import Dict, List, NamedTuple, Optional
+
+from robusta.api import ActionParams
+
+from .cluster_context import get_api_client, summarize_pod
+from .exceptions import KubectlCommandError
+
+
+RESOURCE_ALIASES = {
+    "po": "pods", "pod": "pods", "pods": "pods",
+    "deploy": "deployments", "deployment": "deployments", "deployments": "deployments",
+    "sts": "statefulsets", "statefulset": "statefulsets", "statefulsets": "statefulsets",
+    "ds": "daemonsets", "daemonset": "daemonsets", "daemonsets": "daemonsets",
+    "rs": "replicasets", "replicaset": "replicasets", "replicasets": "replicasets",
+    "job": "jobs", "jobs": "jobs",
+    "no": "nodes", "node": "nodes", "nodes": "nodes",
+}
+# Verbs that take a node name instead of a resource type
+NODE_VERBS = ["cordon", "uncordon"]
+# Name of each workload kind in the Kubernetes client's method names
+WORKLOAD_KINDS = {
+    "deployments": "deployment", "statefulsets": "stateful_set", "daemonsets": "daemon_set",
+    "replicasets": "replica_set", "jobs": "job",
+}
+# Flags taking a value, mapped to the name they are stored under
+VALUE_FLAGS = {
+    "-n": "namespace", "--namespace": "namespace", "--replicas": "replicas", "-c": "container",
+    "--container": "container", "--tail": "tail", "-l": "selector", "--selector": "selector",
+    "--grace-period": "grace_period", "-o": "output", "--output": "output",
+}
+BOOLEAN_FLAGS = {"-A": "all_namespaces", "--all-namespaces": "all_namespaces", "--force": "force"}
+# Flags that would make the command hang or are handled by the executor itself
+IGNORED_FLAGS = ["-f", "--follow", "-w", "--watch", "--wait"]
+# Values of --dry-run, the flag without a value means client like in older kubectl versions
+DRY_RUN_VALUES = ["none", "client", "server"]
+
+
+class KubectlParams(ActionParams):
+    """
+    :var kubectl_allowed_verbs: kubectl verbs suggested commands may use
+    :var kubectl_allowed_resources: Resource types suggested commands may touch
+    :var kubectl_dry_run: Only validate modifying commands on the API server, nothing is changed
+    :var kubectl_timeout_seconds: Timeout of every Kubernetes API request
+    :var kubectl_log_tail_lines: Log lines returned by kubectl logs without --tail
+    """
+    kubectl_allowed_verbs: List[str] = ["get", "logs", "delete", "rollout", "scale", "cordon", "uncordon"]
+    kubectl_allowed_resources: List[str] = ["pods", "deployments", "statefulsets", "daemonsets", "replicasets", "jobs", "nodes"]
+    kubectl_dry_run: bool = False
+    kubectl_timeout_seconds: float = 10
+    kubectl_log_tail_lines: int = 100
+
+
+class KubectlOperation(NamedTuple):
+    verb: str
+    subverb: str
+    resource: str
+    name: str
+    flags: Dict[str, str]
+
+    @property
+    def namespace(self) -> str:
+        return self.flags.get("namespace", "default")
+
+
+def parse_kubectl_command(command: str) -> KubectlOperation:
+    """
+    Parses a single kubectl command line into a structured operation, without any shell involved.
+    """
+    try:
+        tokens = shlex.split(command)
+    except ValueError as e:
+        raise KubectlCommandError(command, f"unable to parse: {e}")
+    if not tokens or tokens[0] != "kubectl":
+        raise KubectlCommandError(command, "not a kubectl command")
+    if any(t in ("|", "||", "&&", ";", ">", ">>", "<") for t in tokens):
+        raise KubectlCommandError(command, "shell operators are not supported")
+
+    flags = {}
+    positional = []
+    i = 1
+    while i < len(tokens):
+        token = tokens[i]
+        flag, has_value, value = token.partition("=")
+        if flag in VALUE_FLAGS:
+            if not has_value:
+                i += 1
+                if i >= len(tokens):
+                    raise KubectlCommandError(command, f"missing value for {flag}")
+                value = tokens[i]
+            flags[VALUE_FLAGS[flag]] = value
+        elif flag in BOOLEAN_FLAGS:
+            flags[BOOLEAN_FLAGS[flag]] = "true"
+        elif flag == "--dry-run":
+            value = value if has_value else "client"
+            if value not in DRY_RUN_VALUES:
+                raise KubectlCommandError(command, f"unsupported value for --dry-run: {value}")
+            flags["dry_run"] = value
+        elif flag in IGNORED_FLAGS:
+            pass
+        elif token.startswith("-"):
+            raise KubectlCommandError(command, f"unsupported flag {flag}")
+        else:
+            positional.append(token)
+        i += 1
+
+    if not positional:
+        raise KubectlCommandError(command, "missing verb")
+    verb = positional.pop(0)
+    subverb = positional.pop(0) if verb == "rollout" and positional else ""
+
+    if verb in NODE_VERBS:
+        resource, name, names = "nodes", positional[0] if positional else "", positional
+    elif verb == "logs":
+        resource, name, names = "pods", positional[0] if positional else "", positional
+        if "/" in name:
+            kind, _, name = name.partition("/")
+            if RESOURCE_ALIASES.get(kind) != "pods":
+                raise KubectlCommandError(command, "logs are only supported for pods")
+    elif positional and "/" in positional[0]:
+        kind, _, name = positional[0].partition("/")
+        resource, names = RESOURCE_ALIASES.get(kind, kind), positional
+    else:
+        resource = RESOURCE_ALIASES.get(positional[0], positional[0]) if positional else ""
+        name, names = positional[1] if len(positional) > 1 else "", positional[1:]
+    # Only the first name would be acted on while the command reads as if all of them were
+    if len(names) > 1:
+        raise KubectlCommandError(command, "only one resource name per command is supported")
+
+    return KubectlOperation(verb, subverb, resource, name, flags)
+
+
+class KubectlExecutor(object):
+    """
+    Runs kubectl commands suggested by the LLM through the in-process Kubernetes API client,
+    restricted to an allowlist of verbs and resources and with a timeout on every request.
+    """
+
+    def __init__(self, params: KubectlParams):
+        self.params = params
+        self.core_v1 = None
+        self.apps_v1 = None
+        self.batch_v1 = None
+        self.timeout = params.kubectl_timeout_seconds
+        self.dry_run = "All" if params.kubectl_dry_run else None
+
+    def __connect(self):
+        # The Kubernetes client is only loaded once a command runs, the params are needed at playbook load.
+        # A missing kube config fails the command like any other error of the API server.
+        from kubernetes import client
+
+        if self.core_v1 is None:
+            api_client = get_api_client()
+            self.core_v1 = client.CoreV1Api(api_client)
+            self.apps_v1 = client.AppsV1Api(api_client)
+            self.batch_v1 = client.BatchV1Api(api_client)
+
+    def validate(self, command: str) -> KubectlOperation:
+        op = parse_kubectl_command(command)
+        if op.verb not in self.params.kubectl_allowed_verbs:
+            raise KubectlCommandError(command, f"verb '{op.verb}' is not allowed")
+        if op.resource not in self.params.kubectl_allowed_resources:
+            raise KubectlCommandError(command, f"resource '{op.resource}' is not allowed")
+        if op.verb not in ("get",) and not op.name:
+            raise KubectlCommandError(command, f"'{op.verb}' needs a resource name")
+        return op
+
+    def execute(self, command: str) -> str:
+        """
+        Runs the command and returns its output, or the reason it was refused or failed.
+        """
+        from kubernetes.client.rest import ApiException
+
+        try:
+            op = self.validate(command)
+            handler = getattr(self, f"_{op.verb}", None)
+            if handler is None:
+                raise KubectlCommandError(command, f"verb '{op.verb}' is not supported")
+            self.__connect()
+            output = handler(op)
+            return f"{output} (dry run)" if self._dry_run(op) and op.verb not in ("get", "logs") else output
+        except KubectlCommandError as e:
+            return e.message
+        except ApiException as e:
+            return f"Error from server ({e.reason}): {e.status}"
+        except Exception as e:
+            return f"Unable to run '{command}': {e}"
+
+    def _dry_run(self, op: KubectlOperation) -> Optional[str]:
+        # Client and server dry runs both only validate on the API server, nothing is changed
+        if self.dry_run or op.flags.get("dry_run") in ("client", "server"):
+            return "All"
+        return None
+
+    def _get(self, op: KubectlOperation) -> str:
+        if op.resource == "nodes":
+            nodes = [self.core_v1.read_node(op.name, _request_timeout=self.timeout)] if op.name else \
+                self.core_v1.list_node(label_selector=op.flags.get("selector"), _request_timeout=self.timeout).items
+            lines = []
+            for node in nodes:
+                ready = next((c.status for c in node.status.conditions or [] if c.type == "Ready"), "Unknown")
+                status = "Ready" if ready == "True" else "NotReady"
+                lines.append(f"{node.metadata.name} {status}{',SchedulingDisabled' if node.spec.unschedulable else ''}")
+            return "\n".join(lines)
+
+        if op.resource == "pods":
+            if op.name:
+                pods = [self.core_v1.read_namespaced_pod(op.name, op.namespace, _request_timeout=self.timeout)]
+            elif op.flags.get("all_namespaces"):
+                pods = self.core_v1.list_pod_for_all_namespaces(
+                    label_selector=op.flags.get("selector"), _request_timeout=self.timeout).items
+            else:
+                pods = self.core_v1.list_namespaced_pod(
+                    op.namespace, label_selector=op.flags.get("selector"), _request_timeout=self.timeout).items
+            return "\n".join(summarize_pod(p).to_line() for p in pods)
+
+        api, kind = self.__workload_api(op)
+        if op.name:
+            items = [getattr(api, f"read_namespaced_{kind}")(op.name, op.namespace, _request_timeout=self.timeout)]
+        else:
+            items = getattr(api, f"list_namespaced_{kind}")(
+                op.namespace, label_selector=op.flags.get("selector"), _request_timeout=self.timeout).items
+        return "\n".join(self.__describe_workload(item) for item in items)
+
+    def _logs(self, op: KubectlOperation) -> str:
+        return self.core_v1.read_namespaced_pod_log(
+            op.name, op.namespace, container=op.flags.get("container"),
+            tail_lines=int(op.flags.get("tail", self.params.kubectl_log_tail_lines)),
+            _request_timeout=self.timeout)
+
+    def _delete(self, op: KubectlOperation) -> str:
+        grace_period = op.flags.get("grace_period")
+        if grace_period is None and op.flags.get("force"):
+            grace_period = "0"
+        options = dict(grace_period_seconds=int(grace_period) if grace_period is not None else None,
+                       dry_run=self._dry_run(op), _request_timeout=self.timeout)
+        if op.resource == "pods":
+            self.core_v1.delete_namespaced_pod(op.name, op.namespace, **options)
+        elif op.resource == "nodes":
+            self.core_v1.delete_node(op.name, **options)
+        else:
+            api, kind = self.__workload_api(op)
+            getattr(api, f"delete_namespaced_{kind}")(op.name, op.namespace, propagation_policy="Background", **options)
+        return f"{op.resource[:-1]} \"{op.name}\" deleted"
+
+    def _rollout(self, op: KubectlOperation) -> str:
+        if op.subverb != "restart" or op.resource not in ("deployments", "statefulsets", "daemonsets"):
+            raise KubectlCommandError(f"kubectl rollout {op.subverb}", "only rollout restart of workloads is supported")
+        # The same annotation kubectl sets to trigger a rolling restart
+        now = datetime.datetime.now(datetime.timezone.utc).isoformat()
+        body = {"spec": {"template": {"metadata": {"annotations": {"kubectl.kubernetes.io/restartedAt": now}}}}}
+        api, kind = self.__workload_api(op)
+        getattr(api, f"patch_namespaced_{kind}")(op.name, op.namespace, body, dry_run=self._dry_run(op),
+                                                 _request_timeout=self.timeout)
+        return f"{op.resource[:-1]} \"{op.name}\" restarted"
+
+    def _scale(self, op: KubectlOperation) -> str:
+        if "replicas" not in op.flags or op.resource not in ("deployments", "statefulsets", "replicasets"):
+            raise KubectlCommandError("kubectl scale", "scale needs --replicas and a deployment, statefulset or replicaset")
+        api, kind = self.__workload_api(op)
+        getattr(api, f"patch_namespaced_{kind}_scale")(
+            op.name, op.namespace, {"spec": {"replicas": int(op.flags["replicas"])}},
+            dry_run=self._dry_run(op), _request_timeout=self.timeout)
+        return f"{op.resource[:-1]} \"{op.name}\" scaled"
+
+    def _cordon(self, op: KubectlOperation, unschedulable: bool = True) -> str:
+        self.core_v1.patch_node(op.name, {"spec": {"unschedulable": unschedulable}},
+                                dry_run=self._dry_run(op), _request_timeout=self.timeout)
+        return f"node \"{op.name}\" {'cordoned' if unschedulable else 'uncordoned'}"
+
+    def _uncordon(self, op: KubectlOperation) -> str:
+        return self._cordon(op, unschedulable=False)
+
+    def __workload_api(self, op: KubectlOperation):
+        if op.resource in WORKLOAD_KINDS:
+            return self.batch_v1 if op.resource == "jobs" else self.apps_v1, WORKLOAD_KINDS[op.resource]
+        raise KubectlCommandError(op.verb, f"resource '{op.resource}' is not supported")
+
+    @staticmethod
+    def __describe_workload(item) -> str:
+        status = item.status
+        if hasattr(status, "ready_replicas"):
+            return f"{item.metadata.name} {status.ready_replicas or 0}/{item.spec.replicas}"
+        if hasattr(status, "number_ready"):
+            return f"{item.metadata.name} {status.number_ready or 0}/{status.desired_number_scheduled or 0}"
+        return f"{item.metadata.name} succeeded={status.succeeded or 0} failed={status.failed or 0}"
+
+
+def run_kubectl_command(command: str, params: Optional[KubectlParams] = None) -> str:
+    return KubectlExecutor(params or KubectlParams()).execute(command)
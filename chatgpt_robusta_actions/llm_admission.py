@@ -0,0 +1,121 @@
+import heapq
+import itertools
+import threading
+import time
+from typing import Dict, Optional
+
+from .rate_limit import TokenBucket
+
+
+# Lower values are admitted first, alerts without a known severity rank like warnings
+SEVERITY_PRIORITY = {
+    "critical": 0,
+    "high": 1,
+    "error": 1,
+    "warning": 2,
+    "medium": 2,
+    "info": 3,
+    "low": 3,
+    "none": 4,
+}
+DEFAULT_PRIORITY = SEVERITY_PRIORITY["warning"]
+# Azure OpenAI enforces its per-minute quotas over short windows, so bursts are limited to this share
+BURST_SECONDS = 10
+
+
+def severity_priority(severity: Optional[str]) -> int:
+    return SEVERITY_PRIORITY.get((severity or "").lower(), DEFAULT_PRIORITY)
+
+
+class AdmissionController(object):
+    """
+    Admits LLM requests within a requests-per-minute and a tokens-per-minute quota.
+
+    Waiting requests queue by priority: only the first request in the queue may take quota, so a
+    critical alert is served before every less severe alert waiting with it, and requests of the
+    same priority are served in arrival order. A quota of None is unlimited.
+    """
+
+    def __init__(self, requests_per_minute: Optional[int], tokens_per_minute: Optional[int]):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.requests = self.__bucket(requests_per_minute)
+        self.tokens = self.__bucket(tokens_per_minute)
+        self.condition = threading.Condition()
+        self.queue = []
+        self.sequence = itertools.count()
+        self.admitted = 0
+        self.rejected = 0
+
+    @staticmethod
+    def __bucket(per_minute: Optional[int]) -> Optional[TokenBucket]:
+        if not per_minute:
+            return None
+        return TokenBucket(per_minute / 60, max(1.0, per_minute * BURST_SECONDS / 60))
+
+    def __wait_time(self, tokens: float) -> float:
+        wait = 0.0
+        if self.requests is not None:
+            wait = self.requests.wait_time(1)
+        if self.tokens is not None:
+            wait = max(wait, self.tokens.wait_time(min(tokens, self.tokens.capacity)))
+        return wait
+
+    def admit(self, tokens: float, priority: int = DEFAULT_PRIORITY, timeout: Optional[float] = None) -> bool:
+        """
+        Blocks until the request of the given size in tokens fits the quotas and returns True,
+        or returns False when that did not happen within timeout seconds.
+        """
+        if self.requests is None and self.tokens is None:
+            return True
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        entry = (priority, next(self.sequence))
+        with self.condition:
+            heapq.heappush(self.queue, entry)
+            try:
+                while True:
+                    wait = None
+                    if self.queue[0] == entry:
+                        wait = self.__wait_time(tokens)
+                        if wait == 0.0:
+                            if self.requests is not None:
+                                self.requests.try_acquire(1)
+                            if self.tokens is not None:
+                                self.tokens.try_acquire(min(tokens, self.tokens.capacity))
+                            self.admitted += 1
+                            return True
+
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and (remaining <= 0 or (wait is not None and wait > remaining)):
+                        self.rejected += 1
+                        return False
+                    # Requests behind the head are woken when it leaves the queue
+                    timeouts = [t for t in (wait, remaining) if t is not None]
+                    self.condition.wait(min(timeouts) if timeouts else None)
+            finally:
+                self.queue.remove(entry)
+                heapq.heapify(self.queue)
+                self.condition.notify_all()
+
+    def stats(self) -> Dict[str, int]:
+        with self.condition:
+            return {"admitted": self.admitted, "rejected": self.rejected, "waiting": len(self.queue)}
+
+
+_controllers_lock = threading.Lock()
+_controllers: Dict[str, AdmissionController] = {}
+
+
+def get_admission_controller(name: str, requests_per_minute: Optional[int],
+                             tokens_per_minute: Optional[int]) -> AdmissionController:
+    """
+    Returns the controller shared by all actions calling the backend with the given name.
+    """
+    with _controllers_lock:
+        controller = _controllers.get(name)
+        if controller is None or (controller.requests_per_minute, controller.tokens_per_minute) != \
+                (requests_per_minute, tokens_per_minute):
+            controller = AdmissionController(requests_per_minute, tokens_per_minute)
+            _controllers[name] = controller
+        return controller
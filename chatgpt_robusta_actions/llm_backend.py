@@ -0,0 +1,414 @@
+import json
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Dict, Iterator, List, Optional
+
+from .exceptions import LLMBackendsExhaustedError, LLMQuotaExceededError, LLMRequestError
+from .fingerprint import fill_template, to_template
+from .instrumentation import CACHE_LOOKUPS, LLM_BACKEND_ERRORS, LLM_TOKENS, span
+from .llm_admission import DEFAULT_PRIORITY, SEVERITY_PRIORITY, get_admission_controller
+from .llm_cache import LLMCacheParams, get_llm_cache
+from .llm_transport import LLMTransportParams, extract_completion_text, iter_sse_data, post_json
+from .prompt_builder import count_tokens
+from .singleflight import SingleFlight
+
+
+AZURE_OPENAI_API_VERSION = "2023-05-15"
+STATS_WINDOW = 100
+DEFAULT_HEDGE_AFTER_SECONDS = 10
+MIN_HEDGE_AFTER_SECONDS = 1
+
+llm_flight = SingleFlight()
+
+
+class LLMBackendParams(LLMCacheParams, LLMTransportParams):
+    """
+    Every provider that is configured takes part in routing, the action's own provider is the primary.
+
+    :var llm_hedge_after_seconds: Start the next backend when the current one did not answer in time,
+        defaults to the current backend's p95 latency
+    :var llm_max_error_rate: Backends above this recent error rate are only used as a last resort
+    :var prompt_token_budget: Maximum prompt size, less relevant context is truncated or dropped to fit
+    :var llm_max_completion_tokens: Maximum length of the answer
+    :var log_payload_sample_rate: Fraction of prompts and answers logged in full at debug level
+    :var metrics_port: Also serve the Prometheus metrics on this port, they are always part of the runner's own metrics
+    :var azure_openai_requests_per_minute: Request quota of the Azure OpenAI deployment, shared by all actions
+    :var azure_openai_tokens_per_minute: Token quota of the Azure OpenAI deployment, shared by all actions
+    :var bedrock_requests_per_minute: Request quota of the Bedrock endpoint, shared by all actions
+    :var bedrock_tokens_per_minute: Token quota of the Bedrock endpoint, shared by all actions
+    :var llm_admission_timeout_seconds: Longest wait for quota before the next backend is tried
+    :var llm_low_priority_admission_timeout_seconds: Longest wait for quota of info and lower severity alerts
+    """
+    azure_openai_token: Optional[str] = None
+    azure_openai_api_base: Optional[str] = None
+    azure_openai_deployment_id: Optional[str] = None
+    model: str = "gpt-4"
+    bedrock_token: Optional[str] = None
+    bedrock_api_base: Optional[str] = None
+    bedrock_deployment_id: Optional[str] = None
+    llm_hedge_after_seconds: Optional[float] = None
+    llm_max_error_rate: float = 0.5
+    prompt_token_budget: int = 3000
+    llm_max_completion_tokens: int = 256
+    log_payload_sample_rate: float = 0.01
+    metrics_port: Optional[int] = None
+    azure_openai_requests_per_minute: Optional[int] = None
+    azure_openai_tokens_per_minute: Optional[int] = None
+    bedrock_requests_per_minute: Optional[int] = None
+    bedrock_tokens_per_minute: Optional[int] = None
+    llm_admission_timeout_seconds: float = 60
+    llm_low_priority_admission_timeout_seconds: float = 5
+
+
+def record_token_usage(backend: str, messages: List[Dict[str, str]], answer: str, usage: Optional[Dict] = None):
+    """
+    Counts the tokens of a request, from the usage reported by the backend or estimated when there is none.
+    """
+    provider = backend.split(":")[0]
+    usage = usage or {}
+    prompt_tokens = usage.get("prompt_tokens") or sum(count_tokens(m["content"]) for m in messages)
+    completion_tokens = usage.get("completion_tokens") or count_tokens(answer)
+    LLM_TOKENS.labels(provider, "prompt").inc(prompt_tokens)
+    LLM_TOKENS.labels(provider, "completion").inc(completion_tokens)
+
+
+class LLMBackend(object):
+    """
+    A chat completion provider. Implementations turn a list of chat messages into the answer text.
+    """
+
+    name = ""
+    requests_per_minute: Optional[int] = None
+    tokens_per_minute: Optional[int] = None
+
+    def complete(self, messages: List[Dict[str, str]], max_tokens: int) -> str:
+        raise NotImplementedError()
+
+    def stream(self, messages: List[Dict[str, str]], max_tokens: int) -> Iterator[str]:
+        """
+        Yields the answer in chunks as it is generated, backends without streaming support
+        yield the complete answer at once.
+        """
+        yield self.complete(messages, max_tokens)
+
+
+class AzureOpenAIBackend(LLMBackend):
+    def __init__(self, params: LLMBackendParams):
+        self.params = params
+        self.name = f"azure:{params.azure_openai_api_base}/{params.azure_openai_deployment_id}"
+        self.requests_per_minute = params.azure_openai_requests_per_minute
+        self.tokens_per_minute = params.azure_openai_tokens_per_minute
+        self.url = (f"{params.azure_openai_api_base.rstrip('/')}/openai/deployments/{params.azure_openai_deployment_id}"
+                    f"/chat/completions?api-version={AZURE_OPENAI_API_VERSION}")
+
+    def complete(self, messages: List[Dict[str, str]], max_tokens: int) -> str:
+        res = post_json(self.params, self.url, {"api-key": self.params.azure_openai_token}, {
+            "model": self.params.model,
+            "messages": messages,
+            "max_tokens": max_tokens,
+            "temperature": 0
+        })
+        body = res.json()
+        answer = extract_completion_text(body)
+        record_token_usage(self.name, messages, answer, body.get("usage"))
+        return answer
+
+    def stream(self, messages: List[Dict[str, str]], max_tokens: int) -> Iterator[str]:
+        res = post_json(self.params, self.url, {"api-key": self.params.azure_openai_token}, {
+            "model": self.params.model,
+            "messages": messages,
+            "max_tokens": max_tokens,
+            "temperature": 0,
+            "stream": True
+        }, stream=True)
+        chunks = []
+        for data in iter_sse_data(res):
+            for choice in json.loads(data).get("choices", []):
+                content = (choice.get("delta") or {}).get("content")
+                if content:
+                    chunks.append(content)
+                    yield content
+        # Streamed responses carry no usage, the tokens are estimated
+        record_token_usage(self.name, messages, "".join(chunks))
+
+
+class BedrockBackend(LLMBackend):
+    def __init__(self, params: LLMBackendParams):
+        self.params = params
+        self.name = f"bedrock:{params.bedrock_api_base}/{params.bedrock_deployment_id}"
+        self.requests_per_minute = params.bedrock_requests_per_minute
+        self.tokens_per_minute = params.bedrock_tokens_per_minute
+        # TODO: most likely these parameters
+        self.url = f"{params.bedrock_api_base}/{params.bedrock_deployment_id}"
+
+    def complete(self, messages: List[Dict[str, str]], max_tokens: int) -> str:
+        headers = {
+            'Content-Type': 'application/json',
+            'Authentication': f"Bearer {self.params.bedrock_token}"
+        }
+        # The Bedrock endpoint takes a single prompt instead of chat messages
+        data = {'request': "\n".join(m["content"] for m in messages)}
+        res = post_json(self.params, self.url, headers, data)
+        body = res.json() if "json" in res.headers.get("Content-Type", "") else res.text
+        answer = extract_completion_text(body)
+        record_token_usage(self.name, messages, answer)
+        return answer
+
+
+def build_backends(params: LLMBackendParams, primary: str) -> List[LLMBackend]:
+    """
+    Returns a backend for every configured provider, the one named primary ("azure" or "bedrock") first.
+    """
+    backends = []
+    if params.azure_openai_token and params.azure_openai_api_base and params.azure_openai_deployment_id:
+        backends.append(AzureOpenAIBackend(params))
+    if params.bedrock_token and params.bedrock_api_base and params.bedrock_deployment_id:
+        backends.append(BedrockBackend(params))
+    backends.sort(key=lambda b: not b.name.startswith(f"{primary}:"))
+    return backends
+
+
+class BackendStats(object):
+    """
+    Latency and error rate of the last STATS_WINDOW requests to one backend.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = deque(maxlen=STATS_WINDOW)
+        self.errors = deque(maxlen=STATS_WINDOW)
+        self.throttled_until = 0.0
+
+    def record(self, latency: float, error: Optional[Exception] = None, throttle_seconds: float = 0):
+        with self.lock:
+            self.errors.append(error is not None)
+            if error is None:
+                self.latencies.append(latency)
+            elif isinstance(error, LLMRequestError) and error.status_code == 429:
+                self.throttled_until = time.monotonic() + throttle_seconds
+
+    def percentile(self, p: float) -> Optional[float]:
+        with self.lock:
+            if not self.latencies:
+                return None
+            ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+
+    def error_rate(self) -> float:
+        with self.lock:
+            return sum(self.errors) / len(self.errors) if self.errors else 0.0
+
+    def throttled(self) -> bool:
+        return self.throttled_until > time.monotonic()
+
+
+_stats_lock = threading.Lock()
+_stats: Dict[str, BackendStats] = {}
+_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="llm-router")
+
+
+def get_backend_stats(name: str) -> BackendStats:
+    with _stats_lock:
+        if name not in _stats:
+            _stats[name] = BackendStats()
+        return _stats[name]
+
+
+class LLMRouter(object):
+    """
+    Sends each request to the fastest healthy backend. When it fails the next one is tried, and
+    when it is slower than the hedge delay the next one is started in parallel and the first
+    successful answer wins.
+
+    Requests wait for the quota of their backend, ordered by priority. A request that gets no quota
+    in time fails over to the next backend like a failed one.
+    """
+
+    def __init__(self, backends: List[LLMBackend], params: LLMBackendParams, priority: int = DEFAULT_PRIORITY):
+        self.backends = backends
+        self.params = params
+        self.priority = priority
+
+    def ranked(self) -> List[LLMBackend]:
+        stats = {backend.name: get_backend_stats(backend.name) for backend in self.backends}
+        unhealthy = {name: s.throttled() or s.error_rate() > self.params.llm_max_error_rate for name, s in stats.items()}
+        p50 = {name: s.percentile(0.5) for name, s in stats.items()}
+        # Healthy backends keep their configured order until all of them have latency measurements,
+        # so a secondary backend that was never tried does not overtake the primary one
+        by_latency = all(p50[name] is not None for name in stats if not unhealthy[name])
+
+        def rank(indexed):
+            index, backend = indexed
+            return unhealthy[backend.name], (p50[backend.name] or 0.0) if by_latency else 0.0, index
+
+        return [b for _, b in sorted(enumerate(self.backends), key=rank)]
+
+    def hedge_delay(self, backend: LLMBackend) -> float:
+        if self.params.llm_hedge_after_seconds is not None:
+            return self.params.llm_hedge_after_seconds
+        p95 = get_backend_stats(backend.name).percentile(0.95)
+        return max(MIN_HEDGE_AFTER_SECONDS, p95) if p95 is not None else DEFAULT_HEDGE_AFTER_SECONDS
+
+    def __admit(self, backend: LLMBackend, messages: List[Dict[str, str]], max_tokens: int):
+        controller = get_admission_controller(backend.name, backend.requests_per_minute, backend.tokens_per_minute)
+        # Azure counts max_tokens against the token quota when the request arrives
+        tokens = sum(count_tokens(m["content"]) for m in messages) + max_tokens
+        timeout = self.params.llm_admission_timeout_seconds
+        if self.priority >= SEVERITY_PRIORITY["info"]:
+            timeout = min(timeout, self.params.llm_low_priority_admission_timeout_seconds)
+        start = time.monotonic()
+        with span("llm_admission", backend.name.split(":")[0]):
+            admitted = controller.admit(tokens, self.priority, timeout)
+        if not admitted:
+            raise LLMQuotaExceededError(backend.name, time.monotonic() - start)
+
+    def __call(self, backend: LLMBackend, messages: List[Dict[str, str]], max_tokens: int) -> str:
+        self.__admit(backend, messages, max_tokens)
+        start = time.monotonic()
+        try:
+            answer = backend.complete(messages, max_tokens)
+        except Exception as e:
+            get_backend_stats(backend.name).record(time.monotonic() - start, e, self.params.llm_backoff_max_seconds)
+            LLM_BACKEND_ERRORS.labels(backend.name.split(":")[0]).inc()
+            raise
+        get_backend_stats(backend.name).record(time.monotonic() - start)
+        return answer
+
+    def complete(self, messages: List[Dict[str, str]], max_tokens: int) -> str:
+        if not self.backends:
+            raise LLMBackendsExhaustedError([])
+
+        candidates = iter(self.ranked())
+        pending: Dict[Future, LLMBackend] = {}
+        errors = []
+
+        def launch() -> bool:
+            backend = next(candidates, None)
+            if backend is None:
+                return False
+            pending[_executor.submit(self.__call, backend, messages, max_tokens)] = backend
+            return True
+
+        launch()
+        hedging = True
+        while pending:
+            newest = list(pending.values())[-1]
+            done, _ = wait(list(pending), timeout=self.hedge_delay(newest) if hedging else None,
+                           return_when=FIRST_COMPLETED)
+            if not done:
+                logging.warning(f"LLM backend '{newest.name}' is slow, hedging with the next backend")
+                hedging = launch()
+                continue
+            for future in done:
+                backend = pending.pop(future)
+                try:
+                    return future.result()
+                except Exception as e:
+                    logging.warning(f"LLM backend '{backend.name}' failed: {e}")
+                    errors.append(f"{backend.name}: {e}")
+                    if not pending:
+                        hedging = launch()
+
+        raise LLMBackendsExhaustedError(errors)
+
+    def stream(self, messages: List[Dict[str, str]], max_tokens: int) -> Iterator[str]:
+        """
+        Streams the answer of the fastest healthy backend. Streams are not hedged, the next
+        backend is only tried when one fails before sending anything.
+        """
+        errors = []
+        for backend in self.ranked():
+            try:
+                self.__admit(backend, messages, max_tokens)
+            except LLMQuotaExceededError as e:
+                logging.warning(str(e))
+                errors.append(f"{backend.name}: {e}")
+                continue
+            start = time.monotonic()
+            started = False
+            try:
+                for chunk in backend.stream(messages, max_tokens):
+                    started = True
+                    yield chunk
+            except Exception as e:
+                get_backend_stats(backend.name).record(time.monotonic() - start, e, self.params.llm_backoff_max_seconds)
+                LLM_BACKEND_ERRORS.labels(backend.name.split(":")[0]).inc()
+                if started:
+                    raise
+                logging.warning(f"LLM backend '{backend.name}' failed: {e}")
+                errors.append(f"{backend.name}: {e}")
+                continue
+            get_backend_stats(backend.name).record(time.monotonic() - start)
+            return
+
+        raise LLMBackendsExhaustedError(errors)
+
+
+def _fill_answers(templates: Optional[List[str]], labels: Dict[str, str]) -> Optional[List[str]]:
+    if templates is None:
+        return None
+    answers = [fill_template(t, labels) for t in templates]
+    return None if any(a is None for a in answers) else answers
+
+
+def query_llm(params: LLMBackendParams, primary: str, cache_key: str, messages: List[Dict[str, str]],
+              priority: int = DEFAULT_PRIORITY, labels: Optional[Dict[str, str]] = None) -> List[str]:
+    """
+    Returns the answers for the messages from the cache or the routed backends. Concurrent
+    queries with the same cache key share one backend request.
+
+    Cache keys ignore volatile labels like the pod, so answers are shared as templates: the names
+    of the alert's objects are replaced with placeholders and filled in with the labels of each
+    alert the answer is returned for.
+
+    :param priority: Queue position for backend quota, see llm_admission.severity_priority
+    :param labels: Labels of the alert, their values are the object names in the answer
+    """
+    cache = get_llm_cache(params)
+    labels = labels or {}
+    executed = []
+
+    def complete():
+        executed.append(True)
+        router = LLMRouter(build_backends(params, primary), params, priority)
+        templates = [to_template(router.complete(messages, params.llm_max_completion_tokens), labels)]
+        # Store only the main response in the cache
+        if params.use_cache:
+            cache.set(cache_key, templates)
+        return templates
+
+    answers = _fill_answers(cache.get(cache_key) if params.use_cache else None, labels)
+    if answers is None:
+        answers = _fill_answers(llm_flight.do(cache_key, complete), labels)
+        if not executed:
+            CACHE_LOOKUPS.labels("llm_single_flight", "coalesced").inc()
+        if answers is None:
+            # The shared answer names an object this alert has no label for
+            answers = _fill_answers(complete(), labels)
+    logging.debug(f"LLM cache stats: {cache.stats()}, single-flight stats: {llm_flight.stats()}")
+    return list(answers)
+
+
+def stream_llm(params: LLMBackendParams, primary: str, cache_key: str, messages: List[Dict[str, str]],
+               priority: int = DEFAULT_PRIORITY, labels: Optional[Dict[str, str]] = None) -> Iterator[str]:
+    """
+    Like query_llm, but yields the answer in chunks as the backend produces it. Streams are not
+    coalesced, a cached answer is yielded as a single chunk.
+    """
+    cache = get_llm_cache(params)
+    labels = labels or {}
+    cached = _fill_answers(cache.get(cache_key) if params.use_cache else None, labels)
+    if cached is not None:
+        yield cached[0]
+        return
+
+    chunks = []
+    router = LLMRouter(build_backends(params, primary), params, priority)
+    for chunk in router.stream(messages, params.llm_max_completion_tokens):
+        chunks.append(chunk)
+        yield chunk
+    if params.use_cache:
+        cache.set(cache_key, [to_template("".join(chunks), labels)])
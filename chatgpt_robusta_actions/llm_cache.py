@@ -0,0 +1,213 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from robusta.api import ActionParams
+
+from .instrumentation import CACHE_EVICTIONS, CACHE_LOOKUPS
+
+
+class LLMCacheParams(ActionParams):
+    """
+    :var use_cache: Serve answers for already seen alert fingerprints from the cache, with the object names of the new alert
+    :var cache_backend: Where cached answers live, one of memory, sqlite or redis
+    :var cache_ttl_seconds: How long an answer stays valid
+    :var cache_max_entries: Maximum number of answers kept, least recently used ones are evicted first
+    :var cache_sqlite_path: Database file for the sqlite backend
+    :var cache_redis_url: Connection URL for the redis backend
+    :var cache_volatile_labels: Labels ignored in the alert fingerprint, defaults to DEFAULT_VOLATILE_LABELS
+    """
+    use_cache: bool = True
+    cache_backend: str = "memory"
+    cache_ttl_seconds: int = 3600
+    cache_max_entries: int = 1000
+    cache_sqlite_path: str = "/tmp/chatgpt_robusta_actions_cache.sqlite"
+    cache_redis_url: str = "redis://localhost:6379/0"
+    cache_volatile_labels: Optional[List[str]] = None
+
+
+class MemoryCacheBackend(object):
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.entries: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self.lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[str]:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.time():
+                del self.entries[key]
+                self.evictions += 1
+                CACHE_EVICTIONS.labels("llm", "expired").inc()
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: str, ttl: int):
+        with self.lock:
+            self.entries[key] = (time.time() + ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+                CACHE_EVICTIONS.labels("llm", "size").inc()
+
+
+class SqliteCacheBackend(object):
+    def __init__(self, path: str, max_entries: int):
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.evictions = 0
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache "
+            "(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL, last_access REAL NOT NULL)")
+        self.conn.commit()
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute("SELECT value, expires_at FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if row[1] < now:
+                self.conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                self.conn.commit()
+                self.evictions += 1
+                CACHE_EVICTIONS.labels("llm", "expired").inc()
+                return None
+            self.conn.execute("UPDATE llm_cache SET last_access = ? WHERE key = ?", (now, key))
+            self.conn.commit()
+            return row[0]
+
+    def set(self, key: str, value: str, ttl: int):
+        now = time.time()
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO llm_cache VALUES (?, ?, ?, ?)", (key, value, now + ttl, now))
+            expired = self.conn.execute("DELETE FROM llm_cache WHERE expires_at < ?", (now,)).rowcount
+            overflow = self.conn.execute(
+                "DELETE FROM llm_cache WHERE key IN "
+                "(SELECT key FROM llm_cache ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)).rowcount
+            self.conn.commit()
+            self.evictions += expired + overflow
+            CACHE_EVICTIONS.labels("llm", "expired").inc(expired)
+            CACHE_EVICTIONS.labels("llm", "size").inc(overflow)
+
+
+class RedisCacheBackend(object):
+    """
+    Redis (or any server speaking its protocol) backend. Redis expires entries by itself, the
+    size limit is enforced through a sorted set of keys ordered by last access.
+    """
+
+    PREFIX = "chatgpt_robusta_actions:llm_cache:"
+
+    def __init__(self, url: str, max_entries: int):
+        import redis
+
+        self.max_entries = max_entries
+        self.redis = redis.Redis.from_url(url)
+        self.index = f"{self.PREFIX}index"
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[str]:
+        value = self.redis.get(f"{self.PREFIX}{key}")
+        if value is None:
+            self.redis.zrem(self.index, key)
+            return None
+        self.redis.zadd(self.index, {key: time.time()})
+        return value.decode("utf-8")
+
+    def set(self, key: str, value: str, ttl: int):
+        pipe = self.redis.pipeline()
+        pipe.set(f"{self.PREFIX}{key}", value, ex=ttl)
+        pipe.zadd(self.index, {key: time.time()})
+        pipe.execute()
+
+        overflow = self.redis.zcard(self.index) - self.max_entries
+        if overflow > 0:
+            evicted = [k.decode("utf-8") for k, _ in self.redis.zpopmin(self.index, overflow)]
+            if evicted:
+                self.redis.delete(*[f"{self.PREFIX}{k}" for k in evicted])
+                self.evictions += len(evicted)
+                CACHE_EVICTIONS.labels("llm", "size").inc(len(evicted))
+
+
+class LLMCache(object):
+    """
+    Caches LLM answers by alert fingerprint on top of a pluggable backend and counts hits,
+    misses and evictions. Backend errors are logged and treated as misses.
+    """
+
+    def __init__(self, backend, ttl: int):
+        self.backend = backend
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        try:
+            value = self.backend.get(key)
+        except Exception as e:
+            logging.warning(f"LLM cache lookup failed: {e}")
+            value = None
+        with self.lock:
+            if value is None:
+                self.misses += 1
+                CACHE_LOOKUPS.labels("llm", "miss").inc()
+                return None
+            self.hits += 1
+        CACHE_LOOKUPS.labels("llm", "hit").inc()
+        return json.loads(value)
+
+    def set(self, key: str, value: Any):
+        try:
+            self.backend.set(key, json.dumps(value), self.ttl)
+        except Exception as e:
+            logging.warning(f"LLM cache store failed: {e}")
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "evictions": self.backend.evictions}
+
+
+_caches_lock = threading.Lock()
+_caches: Dict[tuple, LLMCache] = {}
+
+
+def get_llm_cache(params: LLMCacheParams) -> LLMCache:
+    """
+    Returns the process-wide cache for the given configuration, shared by all providers.
+    """
+    if params.cache_backend == "sqlite":
+        location = params.cache_sqlite_path
+    elif params.cache_backend == "redis":
+        location = params.cache_redis_url
+    elif params.cache_backend == "memory":
+        location = ""
+    else:
+        raise ValueError(f"Unknown cache backend '{params.cache_backend}'")
+
+    config_key = (params.cache_backend, location, params.cache_ttl_seconds, params.cache_max_entries)
+    with _caches_lock:
+        cache = _caches.get(config_key)
+        if cache is None:
+            if params.cache_backend == "sqlite":
+                backend = SqliteCacheBackend(location, params.cache_max_entries)
+            elif params.cache_backend == "redis":
+                backend = RedisCacheBackend(location, params.cache_max_entries)
+            else:
+                backend = MemoryCacheBackend(params.cache_max_entries)
+            cache = LLMCache(backend, params.cache_ttl_seconds)
+            _caches[config_key] = cache
+        return cache
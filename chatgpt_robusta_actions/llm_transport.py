@@ -0,0 +1,149 @@
+import email.utils
+import logging
+import random
+import threading
+import time
+from typing import Any, Dict, Iterator, Optional
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from robusta.api import ActionParams
+
+from .exceptions import LLMRequestError
+from .instrumentation import RETRIES
+
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+POOL_MAXSIZE = 16
+
+
+class LLMTransportParams(ActionParams):
+    """
+    :var llm_connect_timeout: Seconds to wait for the connection to the LLM endpoint
+    :var llm_read_timeout: Seconds to wait for the LLM response
+    :var llm_max_retries: Retries on throttling (429), server errors and connection failures
+    :var llm_backoff_base_seconds: First retry delay, doubled on every further retry
+    :var llm_backoff_max_seconds: Upper bound of a single retry delay
+    """
+    llm_connect_timeout: float = 3.05
+    llm_read_timeout: float = 60
+    llm_max_retries: int = 4
+    llm_backoff_base_seconds: float = 0.5
+    llm_backoff_max_seconds: float = 30
+
+
+_sessions_lock = threading.Lock()
+_sessions: Dict[str, requests.Session] = {}
+
+
+def get_session(url: str) -> requests.Session:
+    """
+    Returns the pooled keep-alive session for the endpoint (scheme and host) of the url.
+    """
+    parts = urlsplit(url)
+    endpoint = f"{parts.scheme}://{parts.netloc}"
+    with _sessions_lock:
+        session = _sessions.get(endpoint)
+        if session is None:
+            session = requests.Session()
+            session.mount(endpoint, HTTPAdapter(pool_connections=1, pool_maxsize=POOL_MAXSIZE))
+            _sessions[endpoint] = session
+        return session
+
+
+def retry_after_seconds(response: requests.Response) -> Optional[float]:
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(params: LLMTransportParams, attempt: int, response: Optional[requests.Response] = None) -> float:
+    if response is not None:
+        retry_after = retry_after_seconds(response)
+        if retry_after is not None:
+            return min(retry_after, params.llm_backoff_max_seconds)
+    # Full jitter, so that alerts throttled together do not retry together
+    return random.uniform(0, min(params.llm_backoff_max_seconds, params.llm_backoff_base_seconds * (2 ** attempt)))
+
+
+def post_json(params: LLMTransportParams, url: str, headers: Dict[str, str], payload: Dict[str, Any],
+              stream: bool = False) -> requests.Response:
+    """
+    POSTs payload to url over the shared session and retries throttled and failed requests.
+    """
+    session = get_session(url)
+    timeout = (params.llm_connect_timeout, params.llm_read_timeout)
+    attempt = 0
+    while True:
+        response = None
+        try:
+            response = session.post(url, headers=headers, json=payload, timeout=timeout, stream=stream)
+            if response.status_code not in RETRY_STATUS_CODES:
+                if not response.ok:
+                    raise LLMRequestError(url, response.status_code, response.text[:500])
+                return response
+            error = f"HTTP {response.status_code}"
+        except (requests.ConnectionError, requests.Timeout) as e:
+            error = str(e)
+
+        if attempt >= params.llm_max_retries:
+            raise LLMRequestError(url, response.status_code if response is not None else None,
+                                  f"{error}, giving up after {attempt + 1} attempts")
+        delay = backoff_delay(params, attempt, response)
+        logging.warning(f"LLM request to {url} failed ({error}), retrying in {delay:.2f}s")
+        if response is not None:
+            response.close()
+        RETRIES.labels("llm").inc()
+        time.sleep(delay)
+        attempt += 1
+
+
+def iter_sse_data(response: requests.Response) -> Iterator[str]:
+    """
+    Yields the data payloads of a server-sent events response until the [DONE] marker.
+    """
+    try:
+        for line in response.iter_lines(decode_unicode=True):
+            if not line or not line.startswith("data:"):
+                continue
+            data = line[len("data:"):].strip()
+            if data == "[DONE]":
+                return
+            yield data
+    finally:
+        response.close()
+
+
+def extract_completion_text(body: Any) -> str:
+    """
+    Returns the completion text from an OpenAI style chat response, or from the plain
+    completion formats returned by Bedrock models.
+    """
+    if isinstance(body, str):
+        return body
+    if isinstance(body, dict):
+        choices = body.get("choices")
+        if choices:
+            choice = choices[0]
+            if "message" in choice:
+                return choice["message"].get("content") or ""
+            return choice.get("text", "")
+        for key in ("completion", "generation", "outputText", "response", "text"):
+            if isinstance(body.get(key), str):
+                return body[key]
+        results = body.get("results")
+        if results and isinstance(results[0], dict):
+            return results[0].get("outputText", "")
+        content = body.get("content")
+        if isinstance(content, list) and content and isinstance(content[0], dict):
+            return content[0].get("text", "")
+    raise ValueError(f"Unrecognized LLM response format: {str(body)[:200]}")
@@ -2,22 +2,47 @@
 
 # Internal resources
 from .exceptions import *
+from .instrumentation import CACHE_LOOKUPS
+from .opsGenieOperationTracker import OpsGenieOperationTracker
+from .rate_limit import TokenBucket
 
 # External resources
-import json
 import time
 import os
-import opsgenie_sdk
+import atexit
 import pytz
 from datetime import datetime
 import tempfile
 import logging
+import threading
 from logging import Logger
+from concurrent.futures import Future, ThreadPoolExecutor
 
-VERSION = "1.3.0"
+VERSION = "1.7.0"
+
+# opsgenie_sdk is a large generated client, it is imported when the first client is created
+opsgenie_sdk = None
+
+class BulkOperationResult(object):
+    """
+    Aggregated outcome of a bulk operation, failed maps alert ids to the reason of the failure.
+    """
+    def __init__(self, operation: str):
+        self.operation = operation
+        self.succeeded = []
+        self.failed = {}
+
+    @property
+    def ok(self):
+        return len(self.failed) == 0
+
+    def __repr__(self):
+        return f"BulkOperationResult(operation='{self.operation}', succeeded={len(self.succeeded)}, failed={len(self.failed)})"
 
 class OpsGenieAlerting(object):
-    def __init__(self, host, opsgenie_api_key, team_name, activationState = False, request_timeout = 10, logger: Logger = None):
+    def __init__(self, host, opsgenie_api_key, team_name, activationState = False, request_timeout = 10, logger: Logger = None,
+                 requestsPerSecond: float = 10, bulkConcurrency: int = 5, queryCacheTtl: float = 15, pageSize: int = 100,
+                 connectionPoolSize: int = 10, retryCount: int = 5, retryMaxDelay: float = 60):
         if logger is None:
             self.logger = Logger("alfabet_root")
             self.logger.disabled = True
@@ -26,18 +51,47 @@ class OpsGenieAlerting(object):
             self.logger = logging.getLogger(logger.name) 
         self.logger.debug(f"Instantiate module object of class '{self.__class__.__module__ + '.' + self.__class__.__qualname__}' and version '{VERSION}'")
 
+        global opsgenie_sdk
+        import opsgenie_sdk
+
         self.conf = opsgenie_sdk.configuration.Configuration()
         self.conf.api_key['Authorization'] = opsgenie_api_key
         self.conf.host = host
+        self.conf.connection_pool_maxsize = connectionPoolSize
+        # The SDK retries throttled and failed requests within retry_max_delay seconds, waiting up to retry_delay in between
+        self.conf.retry_count = retryCount
+        self.conf.retry_max_delay = retryMaxDelay
+        self.conf.retry_delay = min(self.conf.retry_delay, retryMaxDelay)
 
         self.api_client = opsgenie_sdk.api_client.ApiClient(configuration=self.conf)
         self.alert_api = opsgenie_sdk.AlertApi(api_client=self.api_client)
         self.request_timeout = request_timeout
+        self.operationTracker = OpsGenieOperationTracker(self.alert_api, self.logger, requestTimeout=request_timeout)
+        # Shared by all bulk operations of this client to stay below the OpsGenie API rate limits
+        self.rateLimiter = TokenBucket(requestsPerSecond, requestsPerSecond)
+        self.bulkExecutor = ThreadPoolExecutor(max_workers=bulkConcurrency, thread_name_prefix="opsgenie-bulk")
+
+        # Short lived cache of complete query results: query -> (expiry, alerts, alert ids)
+        self.queryCacheTtl = queryCacheTtl
+        self.queryCache = {}
+        self.queryCacheLock = threading.Lock()
+        self.queryCacheGeneration = 0
+        self.pageSize = pageSize
 
         self.team_name = team_name
 
         self.activationState = activationState
 
+    def close(self):
+        self.logger.debug(f"Closing OpsGenie client for '{self.conf.host}'...")
+        self.operationTracker.close()
+        self.bulkExecutor.shutdown(wait=False)
+        if self.api_client._pool is not None:
+            self.api_client._pool.close()
+            self.api_client._pool.join()
+            self.api_client._pool = None
+        self.api_client.rest_client.pool_manager.clear()
+
     def createAlert(self, exceptionSubject: str, exceptionMessage: str, alias: str, alertAttributes , priority: str = "P5", tags = [], attachmentDetails: str = None):        
         result = False
         if self.activationState:
@@ -65,6 +119,7 @@ class OpsGenieAlerting(object):
             create_response = None
             try:
                 create_request = self.alert_api.create_alert(create_alert_payload=body, _request_timeout=self.request_timeout)
+                self.invalidateQueryCache()
                 self.logger.debug(f"Sent request to create an OpsGenie alert: '{create_request.result}' with id '{create_request.request_id}'!")
                 create_response = self.__waitForOpsgenieOperationSuccessResponse(create_request)
                 self.logger.info("Successfully created OpsGenie alert!")
@@ -80,7 +135,7 @@ class OpsGenieAlerting(object):
                     tmpFile.write(str.encode(attachmentDetails))
                     tmpFile.flush()
                     try:
-                        add_response = self.alert_api.add_attachment(identifier=create_response.data.alert_id, file=tmpFile.name)
+                        add_response = self.alert_api.add_attachment(identifier=create_response.data.alert_id, file=tmpFile.name, _request_timeout=self.request_timeout)
                         if add_response.result == "Request will be processed":
                             self.__waitForOpsgenieOperationSuccessResponse(add_response)
                         else:
@@ -101,54 +156,83 @@ class OpsGenieAlerting(object):
         return result
 
     def __waitForOpsgenieOperationSuccessResponse(self, requestResponse):
-        counter = 0
         self.logger.debug(f"Waiting for operation '{requestResponse.request_id}' - '{requestResponse.url}' to complete...")
-        while True:
-            time.sleep(1)
-            if counter >= 15:
-                self.logger.error(f"Unable to process operation for: '{requestResponse.request_id}' - '{requestResponse.url}'. Max retries reached!")
-                raise ResponseCheckRetryError(f"Unable to process operation for: '{requestResponse.request_id}' - '{requestResponse.url}'", 15)
-            try:
-                request_response = self.alert_api.get_request_status(request_id=requestResponse.request_id)
-                if request_response.data.is_success:
-                    if counter >= 1:
-                        self.logger.info(f"After multiple iterations the operation '{requestResponse.request_id}' - '{requestResponse.url}' was processed with status '{request_response.data.status}'!")
-                    else:
-                        self.logger.debug(f"Operation '{requestResponse.request_id}' - '{requestResponse.url}' was processed with status '{request_response.data.status}'!")
-                    return request_response
-            except opsgenie_sdk.ApiException as e:
-                try:
-                    self.logger.warning(f"{json.loads(e.body)['message']}")
-                except Exception:
-                    self.logger.warning(f"Unable to get request response: {e}")
-            except Exception as ex:
-                self.logger.exception(ex)
-            counter += 1
+        return self.operationTracker.track(requestResponse).result()
 
     def getOpenAlertsByTagsAndContainingMessage(self, tags = [], containingMessage: str = "", additionalQuery: str = ""):
-        tagsForQuery = ""
-        for tag in tags: tagsForQuery += f"tag: '{tag}' "
-        query = f"status:'open' {tagsForQuery} message: '{containingMessage}'"
-
-        return self.getAlertsByQuery(f"{additionalQuery} {query}")
+        return self.getAlertsByQuery(self.__buildOpenAlertsQuery(tags, "message", containingMessage, additionalQuery))
     
     def getOpenAlertsByTagsAndContainingDescription(self, tags = [], containingDescription: str = "", additionalQuery: str = ""):
-        tagsForQuery = ""
-        for tag in tags: tagsForQuery += f"tag: '{tag}' "
-        query = f"status:'open' {tagsForQuery} description: '{containingDescription}'"
+        return self.getAlertsByQuery(self.__buildOpenAlertsQuery(tags, "description", containingDescription, additionalQuery))
+
+    def __buildOpenAlertsQuery(self, tags, field: str, containing: str, additionalQuery: str = ""):
+        return " ".join([additionalQuery, "status:'open'", *[f"tag: '{tag}'" for tag in tags], f"{field}: '{containing}'"]).strip()
+
+    def getAlertsByQuery(self, query, useCache: bool = True):
+        alerts = list(self.iterAlertsByQuery(query, useCache))
+        self.logger.debug(f"Returning {len(alerts)} alert/s from query \"{query}\"!")
+        return alerts
 
-        return self.getAlertsByQuery(f"{additionalQuery} {query}")
+    def iterAlertsByQuery(self, query, useCache: bool = True):
+        """
+        Lazily yields all alerts matching the query, fetching further pages only when needed.
+        Completely read results are cached for queryCacheTtl seconds.
+        """
+        if useCache:
+            cached = self.__getCachedQuery(query)
+            if cached is not None:
+                self.logger.debug(f"Serving alerts for query \"{query}\" from cache!")
+                CACHE_LOOKUPS.labels("opsgenie_query", "hit").inc()
+                yield from cached
+                return
+            CACHE_LOOKUPS.labels("opsgenie_query", "miss").inc()
 
-    def getAlertsByQuery(self, query):
         self.logger.debug(f"Looking up alerts with query \"{query}\"...")
-        try:
-            api_response = self.alert_api.list_alerts(query=query)
-            self.logger.debug(f"Returning {len(api_response.data)} alert/s from query \"{query}\"!")
-            return api_response.data
-        except opsgenie_sdk.ApiException as err:
-            self.logger.exception(f"Exception when calling AlertApi->list_alerts: {err}", stack_info=1)
+        generation = self.queryCacheGeneration
+        alerts = []
+        offset = 0
+        while True:
+            try:
+                api_response = self.alert_api.list_alerts(query=query, offset=offset, limit=self.pageSize, _request_timeout=self.request_timeout)
+            except opsgenie_sdk.ApiException as err:
+                self.logger.exception(f"Exception when calling AlertApi->list_alerts: {err}", stack_info=1)
+                return
+            page = api_response.data or []
+            alerts.extend(page)
+            yield from page
+            if len(page) < self.pageSize:
+                break
+            offset += len(page)
+
+        if useCache and self.queryCacheTtl > 0:
+            with self.queryCacheLock:
+                # Skip results that may have been changed by a write while they were read
+                if generation == self.queryCacheGeneration:
+                    self.queryCache[query] = (time.monotonic() + self.queryCacheTtl, alerts, {a.id for a in alerts})
+
+    def __getCachedQuery(self, query):
+        with self.queryCacheLock:
+            entry = self.queryCache.get(query)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self.queryCache[query]
+                return None
+            return list(entry[1])
 
-    def acknowledgeAlert(self, alert, note: str, createSource: str, createUser: str = "OpsGenie service token"):
+    def invalidateQueryCache(self, alertId: str = None):
+        """
+        Drops cached query results containing the alert, or all of them if no alert is given.
+        """
+        with self.queryCacheLock:
+            self.queryCacheGeneration += 1
+            if alertId is None:
+                self.queryCache.clear()
+                return
+            for query in [q for q, entry in self.queryCache.items() if alertId in entry[2]]:
+                del self.queryCache[query]
+
+    def acknowledgeAlert(self, alert, note: str, createSource: str, createUser: str = "OpsGenie service token", waitForCompletion: bool = True):
         if alert.acknowledged:
             self.logger.info(f"Alert is already acknowledged and will not be processed!")
             return True
@@ -157,7 +241,10 @@ class OpsGenieAlerting(object):
         try:
             try:
                 ack_alert_payload = opsgenie_sdk.AcknowledgeAlertPayload(user=createUser, note=note, source=createSource)
-                api_response = self.alert_api.acknowledge_alert(alert.id, acknowledge_alert_payload = ack_alert_payload)
+                api_response = self.alert_api.acknowledge_alert(alert.id, acknowledge_alert_payload = ack_alert_payload, _request_timeout=self.request_timeout)
+                self.invalidateQueryCache(alert.id)
+                if not waitForCompletion:
+                    return self.operationTracker.track(api_response)
                 self.__waitForOpsgenieOperationSuccessResponse(api_response)
                 self.logger.info(f"Alert '{alert.id}' was successfully acknowledged!")
                 return True
@@ -167,12 +254,15 @@ class OpsGenieAlerting(object):
             self.logger.exception(f"Exception when calling AlertApi->acknowledge_alert: {err}", stack_info=1)
         return False
 
-    def addNoteToAlert(self, alert, note: str, createSource: str, createUser: str = "OpsGenie service token"):
+    def addNoteToAlert(self, alert, note: str, createSource: str, createUser: str = "OpsGenie service token", waitForCompletion: bool = True):
         self.logger.debug(f"Adding note to alert '{alert.id}'...")
         try:
             try:
                 add_note_to_alert_payload = opsgenie_sdk.AddNoteToAlertPayload(user=createUser, note=note, source=createSource)
-                api_response = self.alert_api.add_note(alert.id, add_note_to_alert_payload)
+                api_response = self.alert_api.add_note(alert.id, add_note_to_alert_payload, _request_timeout=self.request_timeout)
+                self.invalidateQueryCache(alert.id)
+                if not waitForCompletion:
+                    return self.operationTracker.track(api_response)
                 self.__waitForOpsgenieOperationSuccessResponse(api_response)
                 self.logger.info(f"Note was successfully added to alert '{alert.id}'!")
                 return True
@@ -182,12 +272,15 @@ class OpsGenieAlerting(object):
             self.logger.exception(f"Exception when calling AlertApi->add_note: {err}", stack_info=1)
         return False
     
-    def addTagsToAlert(self, alert, tags, createSource: str, createUser: str = "OpsGenie service token"):
+    def addTagsToAlert(self, alert, tags, createSource: str, createUser: str = "OpsGenie service token", waitForCompletion: bool = True):
         self.logger.debug(f"Adding tag/s to alert '{alert.id}'...")
         try:
             try:
                 add_tags_to_alert_payload = opsgenie_sdk.AddTagsToAlertPayload(user=createUser, tags=tags, source=createSource) 
-                api_response = self.alert_api.add_tags(alert.id, add_tags_to_alert_payload)
+                api_response = self.alert_api.add_tags(alert.id, add_tags_to_alert_payload, _request_timeout=self.request_timeout)
+                self.invalidateQueryCache(alert.id)
+                if not waitForCompletion:
+                    return self.operationTracker.track(api_response)
                 self.__waitForOpsgenieOperationSuccessResponse(api_response)
                 self.logger.info(f"Tag/s was/were successfully added to alert '{alert.id}'!")
                 return True
@@ -197,12 +290,21 @@ class OpsGenieAlerting(object):
             self.logger.exception(f"Exception when calling AlertApi->add_tags: {err}", stack_info=1)
         return False
 
-    def closeAlert(self, alert, reason: str, reasonSource: str, reasonUser: str = "OpsGenie service token", setCloseTags = []):
+    def closeAlert(self, alert, reason: str, reasonSource: str, reasonUser: str = "OpsGenie service token", setCloseTags = [], waitForCompletion: bool = True):
         self.logger.debug(f"Closing alert '{alert.alias}' because '{reason}' ...")
         try:
             try:
                 close_alert_payload = opsgenie_sdk.CloseAlertPayload(user=reasonUser, note=reason, source=reasonSource)
-                api_response = self.alert_api.close_alert(alert.id, close_alert_payload=close_alert_payload)
+                api_response = self.alert_api.close_alert(alert.id, close_alert_payload=close_alert_payload, _request_timeout=self.request_timeout)
+                self.invalidateQueryCache(alert.id)
+                if not waitForCompletion:
+                    future = self.operationTracker.track(api_response)
+                    if len(setCloseTags) > 0:
+                        def addCloseTags(closeFuture):
+                            if closeFuture.exception() is None:
+                                self.addTagsToAlert(alert, setCloseTags, reasonSource, reasonUser, waitForCompletion=False)
+                        future.add_done_callback(addCloseTags)
+                    return future
                 self.__waitForOpsgenieOperationSuccessResponse(api_response)
                 self.logger.info(f"Alert '{alert.id}' was successfully closed!")
                 if len(setCloseTags) > 0:
@@ -224,12 +326,15 @@ class OpsGenieAlerting(object):
         else:
             return self.closeAlert(alert, reason, reasonSource, reasonUser, setCloseTags)
     
-    def updateAlertPriority(self, alert, newPriority: str):
+    def updateAlertPriority(self, alert, newPriority: str, waitForCompletion: bool = True):
         self.logger.debug(f"Updating priority for alert '{alert.alias}' with new priority '{newPriority}' ...")
         try:
             try:
                 updateAlertPriorityPayload = opsgenie_sdk.UpdateAlertPriorityPayload(newPriority)
-                api_response = self.alert_api.update_alert_priority(alert.id, update_alert_priority_payload=updateAlertPriorityPayload)
+                api_response = self.alert_api.update_alert_priority(alert.id, update_alert_priority_payload=updateAlertPriorityPayload, _request_timeout=self.request_timeout)
+                self.invalidateQueryCache(alert.id)
+                if not waitForCompletion:
+                    return self.operationTracker.track(api_response)
                 self.__waitForOpsgenieOperationSuccessResponse(api_response)
                 self.logger.info(f"Priority for alert '{alert.id}' was successfully updated!")
                 return True
@@ -242,18 +347,21 @@ class OpsGenieAlerting(object):
     def getAlert(self, identifier: str, identifierType: str = "alias"):
         self.logger.debug(f"Looking up alert with identifier '{identifier}'...")
         try:
-            api_response = self.alert_api.get_alert(identifier=identifier, identifier_type=identifierType)
+            api_response = self.alert_api.get_alert(identifier=identifier, identifier_type=identifierType, _request_timeout=self.request_timeout)
             self.logger.debug(f"Returning alert '{api_response.data.id}'!")
             return api_response.data
         except opsgenie_sdk.ApiException as err:
             self.logger.exception(f"Exception when calling AlertApi->get_alert: {err}", stack_info=1)
 
-    def updateAlertDetails(self, alert, newDetails: dict):
+    def updateAlertDetails(self, alert, newDetails: dict, waitForCompletion: bool = True):
         self.logger.debug(f"Updating details for alert '{alert.alias} ...")
         try:
             try:
                 updateAlertDetailsPayload = opsgenie_sdk.AddDetailsToAlertPayload(details=newDetails)
-                api_response = self.alert_api.add_details(alert.id, updateAlertDetailsPayload, identifier_type="id")
+                api_response = self.alert_api.add_details(alert.id, updateAlertDetailsPayload, identifier_type="id", _request_timeout=self.request_timeout)
+                self.invalidateQueryCache(alert.id)
+                if not waitForCompletion:
+                    return self.operationTracker.track(api_response)
                 self.__waitForOpsgenieOperationSuccessResponse(api_response)
                 self.logger.info(f"Details for alert '{alert.id}' were successfully updated!")
                 return True
@@ -263,13 +371,16 @@ class OpsGenieAlerting(object):
             self.logger.exception(f"Exception when calling AlertApi->add_details: {err}", stack_info=1)
         return False
 
-    def assignAlert(self, alert, newOwner: str):
+    def assignAlert(self, alert, newOwner: str, waitForCompletion: bool = True):
         self.logger.debug(f"Updating assignee for alert '{alert.alias} ...")
         try:
             try:
                 userRecipient = opsgenie_sdk.UserRecipient(username=newOwner)
                 assignAlertPayload = opsgenie_sdk.AssignAlertPayload(owner=userRecipient)
-                api_response = self.alert_api.assign_alert(alert.id, assignAlertPayload, identifier_type="id")
+                api_response = self.alert_api.assign_alert(alert.id, assignAlertPayload, identifier_type="id", _request_timeout=self.request_timeout)
+                self.invalidateQueryCache(alert.id)
+                if not waitForCompletion:
+                    return self.operationTracker.track(api_response)
                 self.__waitForOpsgenieOperationSuccessResponse(api_response)
                 self.logger.info(f"Assignee for alert '{alert.id}' were successfully updated!")
                 return True
@@ -277,4 +388,87 @@ class OpsGenieAlerting(object):
                 self.logger.error(f"Unable to update OpsGenie alert assignee for alert '{alert.id}'!")
         except opsgenie_sdk.ApiException as err:
             self.logger.exception(f"Exception when calling AlertApi->add_details: {err}", stack_info=1)
-        return False
\ No newline at end of file
+        return False
+
+    def __runBulkOperation(self, operation: str, alerts, submit) -> BulkOperationResult:
+        result = BulkOperationResult(operation)
+        alerts = list(alerts or [])
+        self.logger.debug(f"Running bulk operation '{operation}' for {len(alerts)} alert/s...")
+
+        def submitOne(alert):
+            self.rateLimiter.acquire()
+            # Transport and retry errors of the SDK only fail this alert, not the whole bulk operation
+            try:
+                return submit(alert)
+            except Exception as ex:
+                self.logger.error(f"Unable to submit '{operation}' request for alert '{alert.id}': {ex}")
+                return ex
+
+        for alert, outcome in zip(alerts, self.bulkExecutor.map(submitOne, alerts)):
+            if isinstance(outcome, Exception):
+                result.failed[alert.id] = str(outcome) or outcome.__class__.__name__
+            elif isinstance(outcome, Future):
+                try:
+                    outcome.result()
+                    result.succeeded.append(alert.id)
+                except ResponseCheckRetryError as ex:
+                    result.failed[alert.id] = ex.message
+                except Exception as ex:
+                    result.failed[alert.id] = str(ex) or ex.__class__.__name__
+            elif outcome:
+                result.succeeded.append(alert.id)
+            else:
+                result.failed[alert.id] = f"Unable to submit '{operation}' request!"
+
+        if result.ok:
+            self.logger.info(f"Bulk operation '{operation}' succeeded for {len(result.succeeded)} alert/s!")
+        else:
+            self.logger.error(f"Bulk operation '{operation}' failed for {len(result.failed)} of {len(alerts)} alert/s!")
+        return result
+
+    def bulkAddNoteToAlerts(self, alerts, note: str, createSource: str, createUser: str = "OpsGenie service token") -> BulkOperationResult:
+        return self.__runBulkOperation("add_note", alerts,
+            lambda alert: self.addNoteToAlert(alert, note, createSource, createUser, waitForCompletion=False))
+
+    def bulkAddTagsToAlerts(self, alerts, tags, createSource: str, createUser: str = "OpsGenie service token") -> BulkOperationResult:
+        return self.__runBulkOperation("add_tags", alerts,
+            lambda alert: self.addTagsToAlert(alert, tags, createSource, createUser, waitForCompletion=False))
+
+    def bulkCloseAlerts(self, alerts, reason: str, reasonSource: str, reasonUser: str = "OpsGenie service token", setCloseTags = []) -> BulkOperationResult:
+        return self.__runBulkOperation("close", alerts,
+            lambda alert: self.closeAlert(alert, reason, reasonSource, reasonUser, setCloseTags, waitForCompletion=False))
+
+    def bulkUpdateAlertPriority(self, alerts, newPriority: str) -> BulkOperationResult:
+        return self.__runBulkOperation("update_priority", alerts,
+            lambda alert: self.updateAlertPriority(alert, newPriority, waitForCompletion=False))
+
+
+_clientsLock = threading.Lock()
+_clients = {}
+
+def getOpsGenieClient(host, opsgenie_api_key, team_name, activationState = False, request_timeout = 10, logger: Logger = None, **kwargs) -> OpsGenieAlerting:
+    """
+    Returns the process-wide client for the host and API key, creating it on first use.
+    Team name and request timeout follow the latest caller, further keyword arguments only apply on creation.
+    """
+    with _clientsLock:
+        client = _clients.get((host, opsgenie_api_key))
+        if client is None:
+            client = OpsGenieAlerting(host, opsgenie_api_key, team_name, activationState, request_timeout, logger, **kwargs)
+            _clients[(host, opsgenie_api_key)] = client
+        client.team_name = team_name
+        client.request_timeout = request_timeout
+        client.operationTracker.requestTimeout = request_timeout
+        return client
+
+def closeOpsGenieClients():
+    with _clientsLock:
+        clients = list(_clients.values())
+        _clients.clear()
+    for client in clients:
+        try:
+            client.close()
+        except Exception as ex:
+            client.logger.warning(f"Unable to close OpsGenie client: {ex}")
+
+atexit.register(closeOpsGenieClients)
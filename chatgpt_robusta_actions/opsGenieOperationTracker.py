@@ -0,0 +1,163 @@
+# Base needed imports
+
+# Internal resources
+from .exceptions import *
+from .instrumentation import OPSGENIE_COMPLETION, OPSGENIE_STATUS_POLLS, RETRIES
+
+# External resources
+import json
+import time
+import threading
+from concurrent.futures import Future, InvalidStateError, ThreadPoolExecutor
+from logging import Logger
+
+
+def _resolve(future: Future, result=None, exception: Exception = None) -> bool:
+    # close() and the poller thread may resolve the same operation, the first one wins
+    try:
+        if exception is not None:
+            future.set_exception(exception)
+        else:
+            future.set_result(result)
+        return True
+    except InvalidStateError:
+        return False
+
+
+class _TrackedOperation(object):
+    def __init__(self, requestResponse, initialDelay: float, maxWait: float):
+        self.requestResponse = requestResponse
+        self.future = Future()
+        self.delay = initialDelay
+        self.attempts = 0
+        self.started = time.monotonic()
+        self.nextCheck = time.monotonic() + initialDelay
+        self.deadline = time.monotonic() + maxWait
+
+
+class OpsGenieOperationTracker(object):
+    """
+    Tracks the completion of asynchronously processed OpsGenie write requests.
+
+    Writes are handed over with track() which returns a Future right away. A single background
+    thread polls the request statuses of all outstanding operations in batches, starting after
+    initialDelay and backing off exponentially up to maxDelay per operation.
+    """
+
+    def __init__(self, alert_api, logger: Logger, initialDelay: float = 0.1, maxDelay: float = 2.0,
+                 maxWait: float = 15, maxBatchSize: int = 10, requestTimeout: float = 10):
+        self.alert_api = alert_api
+        self.requestTimeout = requestTimeout
+        self.logger = logger
+        self.initialDelay = initialDelay
+        self.maxDelay = maxDelay
+        self.maxWait = maxWait
+        self.maxBatchSize = maxBatchSize
+
+        self.operations = []
+        self.condition = threading.Condition()
+        self.thread = None
+        self.pollExecutor = None
+        self.closed = False
+
+    def track(self, requestResponse) -> Future:
+        self.logger.debug(f"Tracking operation '{requestResponse.request_id}' - '{requestResponse.url}'...")
+        operation = _TrackedOperation(requestResponse, self.initialDelay, self.maxWait)
+        with self.condition:
+            if self.closed:
+                raise ResponseCheckRetryError(f"Unable to track operation '{requestResponse.request_id}', the tracker is closed", 0)
+            if self.thread is None:
+                self.pollExecutor = ThreadPoolExecutor(max_workers=self.maxBatchSize, thread_name_prefix="opsgenie-poll")
+                self.thread = threading.Thread(target=self.__run, name="opsgenie-tracker", daemon=True)
+                self.thread.start()
+            self.operations.append(operation)
+            self.condition.notify()
+        return operation.future
+
+    def pending(self) -> int:
+        with self.condition:
+            return len(self.operations)
+
+    def close(self):
+        """
+        Stops polling, operations still outstanding fail with ResponseCheckRetryError.
+        """
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        # Let a running batch of polls finish, they are bounded by the request timeout
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join(self.requestTimeout + 1)
+        with self.condition:
+            operations, self.operations = self.operations, []
+        for operation in operations:
+            _resolve(operation.future, exception=ResponseCheckRetryError(
+                f"Stopped tracking operation '{operation.requestResponse.request_id}', the tracker was closed", operation.attempts))
+        if self.pollExecutor is not None:
+            self.pollExecutor.shutdown(wait=False)
+
+    def __run(self):
+        while True:
+            with self.condition:
+                while not self.operations and not self.closed:
+                    self.condition.wait()
+                if self.closed:
+                    return
+                now = time.monotonic()
+                due = [op for op in self.operations if op.nextCheck <= now][:self.maxBatchSize]
+                if not due:
+                    self.condition.wait(min(op.nextCheck for op in self.operations) - now)
+                    continue
+
+            try:
+                results = list(self.pollExecutor.map(self.__poll, due))
+            except RuntimeError:
+                # The poll executor was shut down by close()
+                return
+            for operation, done in zip(due, results):
+                if not done:
+                    operation.delay = min(operation.delay * 2, self.maxDelay)
+                    operation.nextCheck = min(time.monotonic() + operation.delay, operation.deadline)
+                    continue
+                with self.condition:
+                    if operation in self.operations:
+                        self.operations.remove(operation)
+
+    def __poll(self, operation: _TrackedOperation) -> bool:
+        """
+        Checks one operation and resolves its future, returns whether the operation is finished.
+        """
+        import opsgenie_sdk
+
+        requestResponse = operation.requestResponse
+        if operation.future.done():
+            return True
+        operation.attempts += 1
+        OPSGENIE_STATUS_POLLS.inc()
+        if operation.attempts > 1:
+            RETRIES.labels("opsgenie_status").inc()
+        try:
+            request_response = self.alert_api.get_request_status(request_id=requestResponse.request_id,
+                                                                _request_timeout=self.requestTimeout)
+            if request_response.data.is_success:
+                if operation.attempts > 1:
+                    self.logger.info(f"After multiple iterations the operation '{requestResponse.request_id}' - '{requestResponse.url}' was processed with status '{request_response.data.status}'!")
+                else:
+                    self.logger.debug(f"Operation '{requestResponse.request_id}' - '{requestResponse.url}' was processed with status '{request_response.data.status}'!")
+                OPSGENIE_COMPLETION.observe(time.monotonic() - operation.started)
+                _resolve(operation.future, request_response)
+                return True
+        except opsgenie_sdk.ApiException as e:
+            try:
+                self.logger.warning(f"{json.loads(e.body)['message']}")
+            except Exception:
+                self.logger.warning(f"Unable to get request response: {e}")
+        except Exception as ex:
+            self.logger.exception(ex)
+
+        if time.monotonic() >= operation.deadline:
+            self.logger.error(f"Unable to process operation for: '{requestResponse.request_id}' - '{requestResponse.url}'. Max retries reached!")
+            _resolve(operation.future, exception=ResponseCheckRetryError(
+                f"Unable to process operation for: '{requestResponse.request_id}' - '{requestResponse.url}'", operation.attempts))
+            return True
+        return False
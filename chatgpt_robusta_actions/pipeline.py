@@ -0,0 +1,92 @@
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Callable, Dict, Optional, Tuple
+
+from .exceptions import DeadlineExceededError
+from .instrumentation import new_trace_id, span
+
+
+DEFAULT_STAGE_LIMIT = 4
+# Upper bound of threads shared by all stages, the per-stage semaphores do the actual limiting
+MAX_WORKERS = 64
+
+_lock = threading.Lock()
+_stage_semaphores: Dict[Tuple[str, int], threading.BoundedSemaphore] = {}
+_executor: Optional[ThreadPoolExecutor] = None
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="enrichment")
+        return _executor
+
+
+def _get_semaphore(stage: str, limit: int) -> threading.BoundedSemaphore:
+    """
+    Returns the semaphore of the stage for the limit. Action configurations with different limits
+    for a stage each get their own semaphore, so every one of them is enforced.
+    """
+    with _lock:
+        semaphore = _stage_semaphores.get((stage, limit))
+        if semaphore is None:
+            others = [other for other_stage, other in _stage_semaphores if other_stage == stage]
+            if others:
+                logging.info(f"Stage '{stage}' now has limits {sorted(others + [limit])}, each enforced separately")
+            semaphore = _stage_semaphores[(stage, limit)] = threading.BoundedSemaphore(limit)
+        return semaphore
+
+
+class AlertPipeline(object):
+    """
+    Runs the enrichment stages of a single alert on a shared worker pool.
+
+    Every stage has a process-wide concurrency limit, so a storm of alerts queues per stage
+    instead of behind the slowest call, and every alert has a deadline after which it stops waiting.
+    Every call is timed as a span of the alert's trace.
+    """
+
+    def __init__(self, deadline_seconds: float, stage_limits: Dict[str, int] = None, trace_id: str = None):
+        self.deadline_seconds = deadline_seconds
+        self.deadline = time.monotonic() + deadline_seconds
+        self.stage_limits = stage_limits or {}
+        self.trace_id = trace_id or new_trace_id()
+
+    def remaining(self) -> float:
+        return max(0.0, self.deadline - time.monotonic())
+
+    def __traced(self, stage: str, fn: Callable, *args, **kwargs):
+        with span(stage, fn.__name__, self.trace_id):
+            return fn(*args, **kwargs)
+
+    def submit(self, stage: str, fn: Callable, *args, **kwargs) -> Future:
+        """
+        Starts fn in the given stage, blocking while the stage is at its concurrency limit.
+        """
+        semaphore = _get_semaphore(stage, self.stage_limits.get(stage, DEFAULT_STAGE_LIMIT))
+        if not semaphore.acquire(timeout=self.remaining()):
+            logging.warning(f"No free slot in enrichment stage '{stage}' before the alert deadline")
+            raise DeadlineExceededError(stage, self.deadline_seconds)
+
+        try:
+            future = _get_executor().submit(self.__traced, stage, fn, *args, **kwargs)
+        except Exception:
+            semaphore.release()
+            raise
+        # The slot is held until the call really finishes, even if the alert stopped waiting for it
+        future.add_done_callback(lambda _: semaphore.release())
+        future.stage = stage
+        return future
+
+    def wait(self, future: Future):
+        try:
+            return future.result(timeout=self.remaining())
+        except FutureTimeoutError:
+            raise DeadlineExceededError(getattr(future, "stage", ""), self.deadline_seconds)
+
+    def run(self, stage: str, fn: Callable, *args, **kwargs):
+        return self.wait(self.submit(stage, fn, *args, **kwargs))
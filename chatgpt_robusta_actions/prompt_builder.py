@@ -0,0 +1,127 @@
+import logging
+import threading
+from typing import Dict, List, NamedTuple
+
+
+# Rough chars-per-token ratio used when tiktoken is not installed
+CHARS_PER_TOKEN = 4
+# Tokens the chat format adds around every message
+MESSAGE_OVERHEAD_TOKENS = 4
+TRUNCATION_MARKER = "... (truncated)"
+
+# Sections in order of relevance, the first ones are kept when the budget runs out
+SECTION_PRIORITY = ["labels", "title", "description", "changes", "pods", "events", "logs"]
+# Sections that go into the user message, all others become context system messages
+ALERT_SECTIONS = ["labels", "title", "description"]
+# Sections where the most recent lines are at the end and should survive truncation
+TAIL_SECTIONS = ["changes", "events", "logs"]
+
+_encoding_lock = threading.Lock()
+_encoding = None
+_encoding_loaded = False
+
+
+def get_encoding():
+    """
+    Returns the tiktoken encoding, or None when tiktoken is not installed. Loading it reads the
+    BPE ranks from disk or the network, so this happens on the first prompt, not on import.
+    """
+    global _encoding, _encoding_loaded
+    with _encoding_lock:
+        if not _encoding_loaded:
+            try:
+                import tiktoken
+                _encoding = tiktoken.get_encoding("cl100k_base")
+            except Exception:
+                _encoding = None
+            _encoding_loaded = True
+        return _encoding
+
+
+def count_tokens(text: str) -> int:
+    encoding = get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text))
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def truncate_to_tokens(text: str, max_tokens: int, keep_tail: bool = False) -> str:
+    if count_tokens(text) <= max_tokens:
+        return text
+    budget = max_tokens - count_tokens(TRUNCATION_MARKER) - 1
+    if budget <= 0:
+        return ""
+    encoding = get_encoding()
+    if encoding is not None:
+        tokens = encoding.encode(text)
+        kept = encoding.decode(tokens[-budget:] if keep_tail else tokens[:budget])
+    else:
+        chars = budget * CHARS_PER_TOKEN
+        kept = text[-chars:] if keep_tail else text[:chars]
+    # Cut at a line boundary so partial lines do not confuse the model
+    if keep_tail and "\n" in kept:
+        kept = kept[kept.index("\n") + 1:]
+    elif not keep_tail and "\n" in kept:
+        kept = kept[:kept.rindex("\n")]
+    return f"{TRUNCATION_MARKER}\n{kept}" if keep_tail else f"{kept}\n{TRUNCATION_MARKER}"
+
+
+class Prompt(NamedTuple):
+    messages: List[Dict[str, str]]
+    token_count: int
+    truncated: List[str]
+    dropped: List[str]
+
+
+class PromptBuilder(object):
+    """
+    Assembles chat prompts from fixed instructions and per-alert sections within a token budget.
+
+    The instruction messages are built once and counted on the first build. Per alert, the sections are added in
+    SECTION_PRIORITY order, and the first one that no longer fits is truncated, later ones are dropped.
+    """
+
+    def __init__(self, instructions: List[str], question: str):
+        self.static_messages = [{"role": "system", "content": instruction} for instruction in instructions]
+        self.question = question
+        self.static_tokens = None
+        self.question_tokens = None
+
+    def build(self, sections: Dict[str, str], token_budget: int) -> Prompt:
+        # Builders are created on import, counting there would load the tokenizer at startup
+        if self.static_tokens is None:
+            self.question_tokens = count_tokens(self.question) + MESSAGE_OVERHEAD_TOKENS
+            self.static_tokens = sum(count_tokens(m["content"]) + MESSAGE_OVERHEAD_TOKENS for m in self.static_messages)
+        remaining = token_budget - self.static_tokens - self.question_tokens
+        ordered = sorted((name for name, content in sections.items() if content),
+                         key=lambda name: SECTION_PRIORITY.index(name) if name in SECTION_PRIORITY else len(SECTION_PRIORITY))
+
+        fitted = {}
+        truncated = []
+        dropped = []
+        for name in ordered:
+            content = sections[name]
+            overhead = 1 if name in ALERT_SECTIONS else MESSAGE_OVERHEAD_TOKENS + count_tokens("Use this as context information: ")
+            available = remaining - overhead
+            tokens = count_tokens(content)
+            if tokens > available:
+                content = truncate_to_tokens(content, available, keep_tail=name in TAIL_SECTIONS)
+                if not content:
+                    dropped.append(name)
+                    continue
+                truncated.append(name)
+                tokens = count_tokens(content)
+            fitted[name] = content
+            remaining -= tokens + overhead
+
+        alert_text = "\n".join(fitted[name] for name in ordered if name in ALERT_SECTIONS and name in fitted)
+        messages = [
+            *self.static_messages,
+            *[{"role": "system", "content": f"Use this as context information: {fitted[name]}"}
+              for name in ordered if name not in ALERT_SECTIONS and name in fitted],
+            {"role": "user", "content": f"{self.question}\n{alert_text}"}
+        ]
+        token_count = sum(count_tokens(m["content"]) + MESSAGE_OVERHEAD_TOKENS for m in messages)
+        if truncated or dropped:
+            logging.info(f"Prompt over budget of {token_budget} tokens, truncated {truncated}, dropped {dropped}")
+        return Prompt(messages, token_count, truncated, dropped)
@@ -0,0 +1,52 @@
+import threading
+import time
+from typing import Optional
+
+
+class TokenBucket(object):
+    """
+    Classic token bucket: refills rate tokens per second up to capacity, acquire() blocks until
+    enough tokens are available or the timeout runs out.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def __refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, tokens: float = 1) -> float:
+        """
+        Returns the seconds until the tokens will be available without taking them.
+        """
+        with self.lock:
+            self.__refill(time.monotonic())
+            return max(0.0, (tokens - self.tokens) / self.rate)
+
+    def try_acquire(self, tokens: float = 1) -> float:
+        """
+        Takes the tokens if available and returns 0, otherwise returns the seconds until they will be.
+        """
+        with self.lock:
+            self.__refill(time.monotonic())
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                return 0.0
+            return (tokens - self.tokens) / self.rate
+
+    def acquire(self, tokens: float = 1, timeout: Optional[float] = None) -> bool:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = self.try_acquire(tokens)
+            if wait == 0.0:
+                return True
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= wait:
+                    return False
+            time.sleep(wait)
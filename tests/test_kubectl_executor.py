@@ -0,0 +1,90 @@
+import pytest
+
+pytest.importorskip("robusta.api")
+
+from chatgpt_robusta_actions.exceptions import KubectlCommandError
+from chatgpt_robusta_actions.kubectl_executor import KubectlExecutor, KubectlParams, parse_kubectl_command
+
+
+class FakeApi(object):
+    """
+    Records the calls of a Kubernetes API client instead of sending them.
+    """
+
+    def __init__(self):
+        self.calls = []
+
+    def __getattr__(self, method):
+        def call(*args, **kwargs):
+            self.calls.append((method, args, kwargs))
+        return call
+
+
+@pytest.fixture
+def executor():
+    executor = KubectlExecutor(KubectlParams())
+    executor.core_v1, executor.apps_v1, executor.batch_v1 = FakeApi(), FakeApi(), FakeApi()
+    return executor
+
+
+@pytest.mark.parametrize("flag, expected", [("--dry-run=client", "client"), ("--dry-run=server", "server"),
+                                            ("--dry-run", "client"), ("--dry-run=none", "none")])
+def test_parse_keeps_dry_run(flag, expected):
+    op = parse_kubectl_command(f"kubectl delete pod web-1 -n default {flag}")
+    assert op.flags["dry_run"] == expected
+
+
+@pytest.mark.parametrize("dry_run", ["--dry-run=client", "--dry-run=server"])
+def test_dry_run_is_not_applied(executor, dry_run):
+    output = executor.execute(f"kubectl delete pod web-1 -n default {dry_run}")
+    method, args, kwargs = executor.core_v1.calls[0]
+    assert (method, args) == ("delete_namespaced_pod", ("web-1", "default"))
+    assert kwargs["dry_run"] == "All"
+    assert output.endswith("(dry run)")
+
+
+def test_without_dry_run_is_applied(executor):
+    executor.execute("kubectl delete pod web-1 -n default")
+    assert executor.core_v1.calls[0][2]["dry_run"] is None
+
+
+@pytest.mark.parametrize("command", ["kubectl delete pod a b", "kubectl delete pod/a b", "kubectl cordon node-1 node-2",
+                                     "kubectl logs a b"])
+def test_refuses_several_names(executor, command):
+    with pytest.raises(KubectlCommandError):
+        parse_kubectl_command(command)
+    assert executor.execute(command).startswith("Refusing")
+    assert not executor.core_v1.calls
+
+
+def test_rollout_restart(executor):
+    op = parse_kubectl_command("kubectl rollout restart deploy/x -n shop")
+    assert (op.verb, op.subverb, op.resource, op.name, op.namespace) == ("rollout", "restart", "deployments", "x", "shop")
+
+    assert executor.execute("kubectl rollout restart deploy/x -n shop") == 'deployment "x" restarted'
+    method, args, kwargs = executor.apps_v1.calls[0]
+    assert (method, args[:2]) == ("patch_namespaced_deployment", ("x", "shop"))
+    assert "kubectl.kubernetes.io/restartedAt" in args[2]["spec"]["template"]["metadata"]["annotations"]
+
+
+def test_scale(executor):
+    op = parse_kubectl_command("kubectl scale deployment x --replicas 3")
+    assert (op.verb, op.resource, op.name, op.flags["replicas"]) == ("scale", "deployments", "x", "3")
+
+    assert executor.execute("kubectl scale deployment/x --replicas=3 -n shop") == 'deployment "x" scaled'
+    method, args, _ = executor.apps_v1.calls[0]
+    assert (method, args) == ("patch_namespaced_deployment_scale", ("x", "shop", {"spec": {"replicas": 3}}))
+
+
+@pytest.mark.parametrize("command", [
+    "kubectl delete pod web-1 --kubeconfig=/tmp/admin",
+    "kubectl delete pod web-1 --dry-run=maybe",
+    "kubectl get pods | grep web",
+    "kubectl exec web-1 -- sh",
+    "kubectl delete secret db-password",
+    "kubectl scale deployment x",
+    "helm delete web",
+])
+def test_refused_commands(executor, command):
+    assert executor.execute(command).startswith("Refusing")
+    assert not executor.core_v1.calls and not executor.apps_v1.calls